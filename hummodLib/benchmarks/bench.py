@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+MAP = os.path.join(HERE, "..", "..", "preprocessing", "map.json")
+
+import numpy as np
+
+from hummod import HumModClient
+from hummod.bundle import build
+from hummod.graph import DependencyIndex
+from hummod.sweep import grid, sweep
+
+# Fixed scenarios, each run in its own process so startup and peak RSS are real.
+#   python bench.py                         run everything, write results.json
+#   python bench.py --baseline baseline.json  and fail on regressions against it
+# Metrics ending in _per_s are better higher, everything else better lower.
+#
+# Every scenario runs --repeat times and keeps its best numbers. The reference
+# scenario, fixed interpreter and numpy work, always runs too: a baseline's times
+# and throughputs are scaled by how much faster or slower it is on this machine,
+# so one from another machine still holds. That is only an approximation,
+# regenerate the baseline on the machine that checks against it when you can.
+
+
+def synthetic(directory, modules=None, seed=0):
+    # One structure per map.json entry: an Area parm, an Effect curve of it and a
+    # Parms block that CALLS the Parms of everything the entry depends on
+    with open(MAP) as f:
+        dependencyMap = json.load(f)
+    names = [file[:-4] for file in dependencyMap][:modules]
+    known = set(names)
+    rng = random.Random(seed)
+    for name in names:
+        deps = [d for d in dependencyMap[name + ".DES"]["dependencies"] if d in known]
+        top = round(rng.uniform(1.0, 8.0), 2)
+        structure = {
+            "variables": {"Area": {"type": "parm", "value": str(round(rng.uniform(0, top), 2))},
+                          "Effect": {"type": "var", "value": None}},
+            "functions": {"Effect": f"<CURVE((0.0,1.0,0.0),({top / 2},0.5,-0.2),({top},0.0,0.0))>"},
+            "definitions": {"Parms": {"Effect": "Effect [ Area ]", "CALLS": [f"{d}.Parms" for d in deps]}},
+        }
+        if not deps:
+            del structure["definitions"]["Parms"]["CALLS"]
+        with open(os.path.join(directory, f"{name}.json"), "w") as f:
+            json.dump(structure, f)
+    return names
+
+
+def _loadAll(client, names):
+    for name in names:
+        client.getModule(name)
+    return client.compile()
+
+
+def _steps(client, nsteps, **options):
+    for _ in client.run(nsteps, 1.0, **options):
+        pass
+
+
+def reference():
+    # Scalar reads and writes of a small array in an interpreted loop, like a plan step
+    values = np.zeros(64)
+    loops = 200000
+    start = time.perf_counter()
+    for i in range(loops):
+        values[i & 63] = values[(i + 1) & 63] * 0.5 + 1.0
+    return {"loops_per_s": loops / (time.perf_counter() - start)}
+
+
+def valves_startup():
+    # Cold interpreter and import, then loading and compiling the valves in this process
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import hummod"], check=True, cwd=os.path.join(HERE, ".."))
+    import_s = time.perf_counter() - start
+    start = time.perf_counter()
+    client = HumModClient()
+    client.getModule("HeartValves")
+    client.compile()
+    return {"import_s": import_s, "startup_s": time.perf_counter() - start}
+
+
+def valves_steps():
+    client = HumModClient()
+    client.getModule("HeartValves")
+    plan = client.compile()
+    nsteps = 20000
+    start = time.perf_counter()
+    _steps(client, nsteps)
+    elapsed = time.perf_counter() - start
+    return {"steps_per_s": nsteps / elapsed, "variables_per_s": nsteps * len(plan.columns) / elapsed}
+
+
+def valves_long_run():
+    # Long horizon, streaming, a couple of signals kept with a mean window
+    client = HumModClient()
+    client.getModule("HeartValves")
+    client.compile()
+    nsteps = 200000
+    start = time.perf_counter()
+    _steps(client, nsteps, record=["TricuspidValve-*.Effect"], stride=60, reduce="mean")
+    return {"steps_per_s": nsteps / (time.perf_counter() - start)}
+
+
+def valves_ensemble():
+    client = HumModClient()
+    client.getModule("HeartValves")
+    members = 10000
+    areas = np.linspace(0.0, 7.4, members)
+    client.setMembers(members)
+    client.getModule("TricuspidValve-Regurgitation").set("Area", areas)
+    client.compile()
+    start = time.perf_counter()
+    _steps(client, 100, members=members)
+    elapsed = time.perf_counter() - start
+    return {"member_steps_per_s": members * 100 / elapsed}
+
+
+def valves_sweep():
+    params = grid({"TricuspidValve-Regurgitation.Area": np.linspace(0.0, 7.4, 4000)})
+    with tempfile.TemporaryDirectory() as out:
+        start = time.perf_counter()
+        sweep(params, out, outputs=["TricuspidValve-Regurgitation.Effect"], duration=100, chunk=1000, workers=2)
+        elapsed = time.perf_counter() - start
+    return {"runs_per_s": 4000 / elapsed}
+
+
+def synthetic_startup():
+    with tempfile.TemporaryDirectory() as directory:
+        names = synthetic(directory)
+        start = time.perf_counter()
+        plan = _loadAll(HumModClient(structures=directory), names)
+        json_s = time.perf_counter() - start
+        bundle = os.path.join(directory, "model.hmb")
+        build(bundle, directory)
+        start = time.perf_counter()
+        _loadAll(HumModClient(bundle, directory), names)
+        bundle_s = time.perf_counter() - start
+    return {"modules": len(names), "variables": len(plan.names), "json_startup_s": json_s,
+            "bundle_startup_s": bundle_s}
+
+
+def synthetic_steps():
+    with tempfile.TemporaryDirectory() as directory:
+        names = synthetic(directory)
+        client = HumModClient(structures=directory)
+        plan = _loadAll(client, names)
+        nsteps = 200
+        start = time.perf_counter()
+        _steps(client, nsteps)
+        elapsed = time.perf_counter() - start
+    return {"steps_per_s": nsteps / elapsed, "variables_per_s": nsteps * len(plan.columns) / elapsed}
+
+
+def preprocessing_map():
+    start = time.perf_counter()
+    index = DependencyIndex.fromMap(MAP)
+    index.closureSums(np.ones(len(index.names)), includeSelf=True)
+    return {"index_s": time.perf_counter() - start}
+
+
+SCENARIOS = {f.__name__: f for f in (reference, valves_startup, valves_steps, valves_long_run, valves_ensemble, valves_sweep,
+                                     synthetic_startup, synthetic_steps, preprocessing_map)}
+
+
+def measure(name, repeat=1):
+    # In fresh processes: the scenario's best metrics plus the process peak RSS
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--scenario", name],
+                             check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return {metric: (max if metric.endswith("_per_s") else min)(run[metric] for run in runs) for metric in runs[0]}
+
+
+def compare(results, baseline, threshold):
+    # Times and throughputs against the baseline's scaled by the reference speed of both runs
+    speed = 1.0
+    if "reference" in results and "reference" in baseline:
+        speed = results["reference"]["loops_per_s"] / baseline["reference"]["loops_per_s"]
+    regressions = []
+    for name, metrics in baseline.items():
+        for metric, expected in metrics.items():
+            actual = results.get(name, {}).get(metric)
+            if actual is None or name == "reference" or metric in ("modules", "variables"):
+                continue
+            higher = metric.endswith("_per_s")
+            if higher:
+                expected *= speed
+            elif metric.endswith("_s"):
+                expected /= speed
+            if (higher and actual < expected * (1 - threshold)) or (not higher and actual > expected * (1 + threshold)):
+                regressions.append(f"{name}.{metric}: {actual:.4g} vs baseline {expected:.4g}")
+    return regressions
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(description="HumMod benchmark suite")
+    args.add_argument("--scenario", help="run one scenario in this process and print its metrics")
+    args.add_argument("--only", nargs="*", help="scenarios to run, default all")
+    args.add_argument("--out", default="results.json")
+    args.add_argument("--baseline", help="baseline JSON to compare against")
+    args.add_argument("--threshold", type=float, default=0.5, help="allowed relative slowdown")
+    args.add_argument("--repeat", type=int, default=3, help="runs per scenario, the best counts")
+    args = args.parse_args()
+
+    if args.scenario:
+        metrics = SCENARIOS[args.scenario]()
+        metrics["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(json.dumps(metrics))
+        sys.exit(0)
+
+    results = {}
+    for name in ["reference"] + [name for name in args.only or SCENARIOS if name != "reference"]:
+        results[name] = measure(name, args.repeat)
+        print(name, " ".join(f"{k}={v:.4g}" for k, v in results[name].items()))
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        sys.exit(1 if regressions else 0)
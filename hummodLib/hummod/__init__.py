@@ -1,4 +1,8 @@
 from .client import HumModClient
+from .results import Results
+from .schedule import Schedule
+from .sinks import NpySink, ParquetSink
+from .snapshot import Snapshot
 
-def createClient():
-    return HumModClient() 
\ No newline at end of file
+def createClient(bundle=None):
+    return HumModClient(bundle) 
\ No newline at end of file
@@ -0,0 +1,150 @@
+import gc
+import marshal
+import mmap
+import os
+import struct
+import sys
+import threading
+
+import numpy as np
+
+from .curve import Curve
+
+
+# All structures compiled into one read-only file that is memory mapped and
+# loaded module by module. Layout:
+#   header: magic, format version, marshal version, offsets and rows of both tables, index offset and length
+#   curve table: float64 (x, y, slope) rows of every curve, shared by all modules
+#   segment table: float64 (x, c0, c1, c2, c3) Hermite segment rows of every curve
+#   records: one marshal blob per module:
+#            (data, curves, definitions, blocks, variables, dfqs, ModulePlan.dump())
+#   index: marshal dict name -> (offset, length) of its record
+# Curves are views into the tables and module plans are stored compiled, so a load
+# parses, sorts and schedules nothing.
+
+MAGIC = b'HUMMODB\0'
+FORMAT = 3
+_HEADER = struct.Struct('<8sIIQQQQQQ')
+
+_open = {}
+_lock = threading.Lock()
+
+
+def _intern(obj):
+    # Interned strings are written once per record by marshal
+    if isinstance(obj, str):
+        return sys.intern(obj)
+    if isinstance(obj, dict):
+        return {_intern(k): _intern(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_intern(v) for v in obj)
+    return obj
+
+
+def build(out_path, structures_dir=None):
+    #Compiles every structure JSON into one bundle file, returns the number of modules
+    from .client import HumModClient
+    if structures_dir is None:
+        structures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'structures')
+    client = HumModClient()
+    client.structures = structures_dir
+    names = sorted(f[:-5] for f in os.listdir(structures_dir) if f.endswith('.json'))
+
+    points = []
+    segments = []
+    records = []
+    for name in names:
+        module = client.getModule(name)
+        curves = {}
+        for func_name, curve in module.curves.items():
+            rows = curve.segments()
+            curves[func_name] = (len(points), len(curve.points), len(segments), len(rows))
+            points.extend(curve.points)
+            segments.extend(rows.tolist())
+        record = (module.data, curves, module.definitions, module.blocks, module.variables, module.dfqs,
+                  module.plan.dump(module))
+        records.append((name, marshal.dumps(_intern(record))))
+
+    table = np.array(points, dtype='<f8').reshape(-1, 3).tobytes()
+    segment_table = np.array(segments, dtype='<f8').reshape(-1, 5).tobytes()
+    offset = _HEADER.size + (-_HEADER.size % 8)
+    segment_offset = offset + len(table)
+    index = {}
+    body = bytearray(b'\0' * (offset - _HEADER.size))
+    body += table
+    body += segment_table
+    position = segment_offset + len(segment_table)
+    for name, blob in records:
+        index[name] = (position, len(blob))
+        body += blob
+        position += len(blob)
+    index_blob = marshal.dumps(_intern(index))
+
+    tmp = out_path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT, marshal.version, offset, len(points), segment_offset, len(segments),
+                             position, len(index_blob)))
+        f.write(body)
+        f.write(index_blob)
+    os.replace(tmp, out_path)
+    return len(names)
+
+
+class Bundle:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a structure bundle")
+        # Checked before the rest of the header, whose layout depends on the format
+        fmt, marshal_version = struct.unpack_from('<II', self._mm, len(MAGIC))
+        if fmt != FORMAT or marshal_version != marshal.version:
+            raise ValueError(f"{path} was built by another version (format {fmt}), rebuild it")
+        _, _, _, offset, rows, segment_offset, segment_rows, index_offset, index_len = _HEADER.unpack_from(self._mm)
+        # Shared, read-only views of the mapped curve tables
+        self.points = np.frombuffer(self._mm, dtype='<f8', count=rows * 3, offset=offset).reshape(-1, 3)
+        self.segments = np.frombuffer(self._mm, dtype='<f8', count=segment_rows * 5,
+                                      offset=segment_offset).reshape(-1, 5)
+        self.index = marshal.loads(self._mm[index_offset:index_offset + index_len])
+
+    @classmethod
+    def open(cls, path):
+        #One mapping per file for the whole process
+        path = os.path.abspath(path)
+        with _lock:
+            if path not in _open:
+                _open[path] = cls(path)
+            return _open[path]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self):
+        return list(self.index)
+
+    def load(self, name):
+        #Returns (data, curves, definitions, blocks, variables, dfqs, plan record) of one module,
+        #see ModulePlan.restore for the last
+        offset, length = self.index[name]
+        # A record is thousands of small containers that all stay alive, the cyclic
+        # collector would only rescan the ever growing heap while they are read
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            data, curves, definitions, blocks, variables, dfqs, plan = marshal.loads(self._mm[offset:offset + length])
+        finally:
+            if enabled:
+                gc.enable()
+        points, segments = self.points, self.segments
+        curves = {func_name: Curve.table(points[row:row + n], segments[first:first + count])
+                  for func_name, (row, n, first, count) in curves.items()}
+        return data, curves, definitions, blocks, variables, dfqs, plan
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m hummod.bundle out.hmb [structuresDir]")
+        sys.exit(1)
+    count = build(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"Bundled {count} structures into {sys.argv[1]}")
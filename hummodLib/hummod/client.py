@@ -1,22 +1,95 @@
+import fnmatch
+import os
+import threading
+import warnings
+
+import numpy as np
+
+from .bundle import Bundle
 from .module import Module
+from .plan import Plan, closure
+from .profiler import Profiler
+from .integrator import Integrator
+from .results import Recorder, Results, Sample
+from .snapshot import Snapshot
+from .steady import SteadyState
 
 class HumModClient:
-    def __init__(self):
+    def __init__(self, bundle=None, structures=None):
         #stores all loaded modules
         self.modules = {}
+        #Precompiled structure bundle (path or Bundle), modules it lacks come from the JSON files
+        self.bundle = Bundle.open(bundle) if isinstance(bundle, str) else bundle
+        self.structures = structures #Directory of structure JSON files, None for the packaged ones
         self.dt=1
+        self.plan = None #Compiled plan over the loaded modules
+        self._compiled = None #Last plan compiled, its values carry over into the next one
+        self.members = None #Ensemble size, None for a single run
+        self.required = None #Variables the outputs depend on, None evaluates everything
+        self.reactive = False #Only recompute what changed since the last step
+        self.profiler = None #Profiler collecting timings, None when not profiling
+        self.loopOptions = {} #Solver settings of algebraic loops, see setLoopSolver
+        self.rates = {} #Module name or pattern -> minutes between its evaluations, see setRates
+        self.rateMode = 'hold'
+        self._targets = {} #"Module.Var" -> (module, var) of getVar
+        self._local = threading.local() #Per thread state of threads sharing this client
+
+    @property
+    def _calculating(self):
+        #(module, var) of the Module.calc calls in progress on this thread
+        calculating = getattr(self._local, 'calculating', None)
+        if calculating is None:
+            calculating = self._local.calculating = set()
+        return calculating
 
     def getModule(self, name):
         #returns cached module or loads a new one
+        #Structures come from the process wide registry, so threads sharing a client
+        #or not never load the same one twice
         if name not in self.modules:
-            self.modules[name] = Module(self, name)
+            if self.profiler is not None:
+                self.profiler.push('load')
+                self.profiler.push(name)
+                module = Module(self, name)
+                self.profiler.pop()
+                self.profiler.pop()
+            else:
+                module = Module(self, name)
+            if self.modules.setdefault(name, module) is module:
+                self.plan = None
         return self.modules[name]
 
+    @property
+    def _current(self):
+        #Plan holding the current values: the compiled one, or after a module load the one
+        #the next compile carries them over from
+        return self.plan if self.plan is not None else self._compiled
+
     def getVar(self, name):
-        #Used for inter-module variable refrences
-        module_name, var_name = name.split(".")
-        module = self.getModule(module_name)
+        #Used for inter-module variable refrences. Current value from the plan once one is compiled
+        target = self._targets.get(name)
+        if target is None:
+            module_name, var_name = name.split(".")
+            target = self._targets[name] = (self.getModule(module_name), var_name)
+        module, var_name = target
         return module.get(var_name)
+
+    def handle(self, name):
+        #Integer slot of a "Module.Var" for read and write. Slots stay valid when
+        #more modules load, new ones are appended.
+        return self.compile().index[name]
+
+    def read(self, handle):
+        return self.compile().read(handle)
+
+    def write(self, handle, value):
+        #Module.set by slot, no name lookups
+        plan = self.compile()
+        module_name, var_name = plan.owner(handle)
+        module = self.modules[module_name]
+        module.values[var_name] = value
+        module.user_set.add(var_name)
+        plan.set(handle, value)
     
     def displayModules(self):
         #Will display all modules which are triggered by calculating parameters
@@ -26,27 +99,296 @@ class HumModClient:
 
 
 
-    def simulate(self, duration=10.0, timestep=1.0, apply=None):
-        self.dt = timestep
+    def prune(self, outputs=None, inputs=()):
+        #Restricts loading and evaluation to what the outputs ("Module.Var" or "Module.Block")
+        #depend on, plus the inputs that will be set. prune() goes back to evaluating everything.
+        self.required = closure(self, outputs, inputs) if outputs is not None else None
+        self.plan = None
+        return self.required
+
+    def reset(self):
+        #Clears every Module.set and puts the plan back to its initial values, keeping loaded modules
+        for module in self.modules.values():
+            module.values.clear()
+            module.user_set.clear()
+        if self.plan is not None:
+            self.plan.reset()
+        self._compiled = self.plan
+
+    def profile(self, enabled=True):
+        #Starts timing loads, steps, apply callbacks and every evaluated value into a new
+        #client.profiler, see Profiler.table and Profiler.folded. profile(False) stops.
+        self.profiler = Profiler() if enabled else None
+        if self.plan is not None:
+            self.plan.profiler = self.profiler
+        return self.profiler
+
+    def setMembers(self, members):
+        #Ensemble size for the next run, None for single runs
+        if members != self.members:
+            self.members = members
+            self.plan = self._compiled = None
+
+    def setReactive(self, enabled=True):
+        #In reactive mode Module.set dirties only the values downstream of it and a step
+        #re-evaluates just those plus whatever the integrated states feed
+        self.reactive = enabled
+        if self.plan is not None:
+            self.plan.setReactive(enabled)
+
+    def setLoopSolver(self, method='newton', rtol=1e-8, atol=1e-10, max_iter=50, relaxation=1.0):
+        #How algebraic loops (variables computed from each other within a step) are solved:
+        #'newton' with a cached finite difference Jacobian, or 'relax' fixed point iteration
+        #x += relaxation * (g(x) - x). compile().loops lists them with their iteration counts.
+        self.loopOptions = dict(method=method, rtol=rtol, atol=atol, max_iter=max_iter, relaxation=relaxation)
+        if self.plan is not None:
+            for loop in self.plan.loops:
+                loop.configure(**self.loopOptions)
+
+    def setRates(self, rates=None, mode='hold'):
+        #Multi-rate runs: {module name or glob pattern: minutes} evaluates those modules only every
+        #that many minutes (rounded to whole timesteps), every other module each step. In between
+        #their values hold, or with mode='linear' follow the line through their last two updates.
+        #DFQ states are integrated every step, so what their derivatives are computed from runs every step.
+        #None or {} goes back to evaluating everything every step. Reactive runs ignore rates. See inferRates
+        if mode not in ('hold', 'linear'):
+            raise ValueError(f"Unknown rate mode: {mode}, expected 'hold' or 'linear'")
+        self.rates = dict(rates or {})
+        self.rateMode = mode
+
+    def inferRates(self, duration=10.0, timestep=1.0, tolerance=1e-3, longest=None, apply=None):
+        #Rates for setRates from a probe run of a fork, this client is left as it is. A module gets the
+        #longest power of two multiple of timestep, up to longest (default duration) minutes, over
+        #which none of its values moves more than tolerance times its largest magnitude in the probe.
+        #Only what the probe exercises is seen, pass the run's apply to include its interventions.
+        probe = self.fork()
+        probe.rates = {}
+        longest = duration if longest is None else longest
+        change = peak = last = None
+        for sample in probe.run(duration, timestep, apply, self.members):
+            values = sample.values.reshape(-1, len(sample.columns))
+            if last is None:
+                change = np.zeros(len(sample.columns))
+                peak = np.zeros(len(sample.columns))
+            else:
+                change = np.maximum(change, np.max(np.abs(values - last), axis=0))
+            peak = np.maximum(peak, np.max(np.abs(values), axis=0))
+            last = values
+        if last is None:
+            return {}
+        fastest = {}
+        for name, value in zip(sample.columns, change / np.where(peak > 0, peak, 1.0)):
+            module = name.split('.', 1)[0]
+            fastest[module] = max(fastest.get(module, 0.0), value)
+        rates = {}
+        for module, value in fastest.items():
+            if value == 0:
+                # Never changed in the probe
+                period = longest
+            else:
+                steps = tolerance / value
+                period = min(timestep * 2 ** int(np.log2(steps)) if steps >= 2 else timestep, longest)
+            if period >= 2 * timestep:
+                rates[module] = period
+        return rates
+
+    def _rateSteps(self, plan, timestep):
+        # Module -> steps between evaluations for plan.setRates
+        steps = {}
+        for pattern, minutes in self.rates.items():
+            for name in fnmatch.filter(plan.ranges, pattern):
+                steps[name] = max(1, int(round(minutes / timestep)))
+        return steps
+
+    def compile(self):
+        #Builds the evaluation plan for all loaded modules, reused until a new module loads.
+        #A rebuilt plan goes on from the values of the one it replaces, integrated states included
+        if self.plan is None:
+            if self.profiler is not None:
+                self.profiler.push('compile')
+                self.plan = self._compiled = Plan(self, self._compiled)
+                self.profiler.pop()
+            else:
+                self.plan = self._compiled = Plan(self, self._compiled)
+        return self.plan
+
+    def snapshot(self):
+        #Copy of the state: plan values, Module.set values and run settings, see Snapshot.save
+        return Snapshot.capture(self)
+
+    def steadyState(self, members=None, rtol=1e-6, atol=1e-9, max_iter=50, krylov=20, tau=1.0, max_steps=200):
+        #Solves for the state where every DFQ derivative is 0 (|dy/dt| <= atol + rtol * |y|) instead
+        #of simulating until the model settles, see steady.py. Leaves the client there, so simulate
+        #goes on from it, and returns a Snapshot of it for restore or Snapshot.save, with the
+        #solver's converged, residual (largest |dy/dt|) and iterations. When it did not converge
+        #that is a RuntimeWarning too, the client is left at the last state.
+        self.setMembers(members)
+        solver = SteadyState(self.compile(), rtol, atol, max_iter, krylov, tau, max_steps)
+        if not solver.solve():
+            warnings.warn(f"No steady state after {solver.iterations} iterations, largest |dy/dt| "
+                          f"{np.max(solver.residual)}, left at the last state.", RuntimeWarning, stacklevel=2)
+        elif solver.method is not None:
+            print(f"Steady state by {solver.method} in {solver.evaluations} evaluations.")
+        snapshot = self.snapshot()
+        snapshot.converged = solver.converged
+        snapshot.residual = solver.residual
+        snapshot.iterations = solver.iterations
+        return snapshot
+
+    def restore(self, snapshot):
+        #Back to a snapshot, or a checkpoint file, of this client or any with the same modules loaded
+        if isinstance(snapshot, str):
+            snapshot = Snapshot.load(snapshot)
+        for name in snapshot.modules:
+            self.getModule(name)
+        self.dt = snapshot.dt
+        self.setMembers(snapshot.members)
+        if snapshot.required != self.required:
+            self.required = snapshot.required
+            self.plan = None
+        plan = self.compile()
+        if plan.names != snapshot.names:
+            raise ValueError("Snapshot was taken with other modules loaded, its values do not fit this plan")
+        for name, module in self.modules.items():
+            module.values = {var: np.copy(value) if isinstance(value, np.ndarray) else value
+                             for var, value in snapshot.user.get(name, {}).items()}
+            module.user_set = set(module.values)
+        plan.restore(snapshot.values, snapshot.pinned)
+        return plan
+
+    def fork(self):
+        #Independent client continuing from the current state. Loaded structures and the
+        #compiled plan are shared, only values and set values are copied.
+        other = HumModClient(self.bundle, self.structures)
+        other.dt = self.dt
+        other.members = self.members
+        other.required = self.required
+        other.reactive = self.reactive
+        other.loopOptions = self.loopOptions
+        other.rates = dict(self.rates)
+        other.rateMode = self.rateMode
+        for name, module in self.modules.items():
+            other.modules[name] = module.fork(other)
+        if self.plan is not None:
+            other.plan = other._compiled = self.plan.fork()
+        return other
+
+    def simulate(self, duration=10.0, timestep=1.0, apply=None, members=None, method='euler', rtol=1e-3, atol=1e-6,
+                 record=None, stride=1, reduce=None, schedule=None):
+        #Returns a Results table of every numeric variable, steps x variables.
+        #With members=N every variable holds N values and the table is N x steps x variables.
+        #DFQ states are integrated with method: 'euler', 'rk4', adaptive 'rk45' or stiff 'implicit'
+        #record limits the columns to "Module.Var" names or glob patterns, stride keeps every
+        #stride-th step, or with reduce='min'/'max'/'mean' one reduced row per stride steps.
+        #A Schedule of steps, ramps, profiles and infusions is applied before apply every step
         nsteps = int(duration / timestep)
-        print(f"Simulating for {duration} minutes, timestep {timestep} min, {nsteps} steps.")
-        results = []
-        for step in range(nsteps):
-            if(apply):
-                apply(self, step)
-            step_result = {}
-            for module_name, module in self.modules.items():
-                # Calculate all variables
-                if hasattr(module, 'variables'):
-                    for var in module.vars():
-                        val = module.calc(var)
-                        # Only store numerical values
-                        if isinstance(val, (int, float)):
-                            step_result[f"{module_name}.{var}"] = val
-                # Calculate all definitions (blocks/calls)
-                if hasattr(module, 'data') and 'definitions' in module.data:
-                    for def_name in module.data['definitions']:
-                        module.calc(def_name)
-            results.append(step_result)
+        if members:
+            print(f"Simulating {members} members for {duration} minutes, timestep {timestep} min, {nsteps} steps.")
+        else:
+            print(f"Simulating for {duration} minutes, timestep {timestep} min, {nsteps} steps.")
+        nrows = -(-nsteps // stride)
+        results = None
+        for sample in self.run(duration, timestep, apply, members, method, rtol, atol,
+                               record=record, stride=stride, reduce=reduce, schedule=schedule):
+            if results is None:
+                results = Results.allocate(sample.columns, nrows, timestep * stride, members)
+            results.data[..., sample.step // stride, :] = sample.values
+        if results is None:
+            results = Results.allocate(self.compile().resolve(record), 0, timestep * stride, members)
         print("Simulation complete.")
         return results
+
+    def run(self, duration=10.0, timestep=1.0, apply=None, members=None, method='euler', rtol=1e-3, atol=1e-6,
+            record=None, stride=1, reduce=None, sinks=(), checkpoint=None, every=1000, schedule=None):
+        #Same as simulate but yields a Sample per recorded row as soon as it is computed.
+        #Every sample also goes to the given sinks, which are closed when the run ends.
+        #With a checkpoint path a snapshot is saved there every `every` steps, after flushing the
+        #sinks. If the file exists the run resumes from it, the sinks keep the rows written before
+        #it (see Sink.open), and it is removed once the run completes.
+        self.dt = timestep
+        self.setMembers(members)
+        nsteps = int(duration / timestep)
+        start = 0
+        if checkpoint is not None:
+            if every % stride:
+                raise ValueError("every must be a multiple of stride")
+            if os.path.exists(checkpoint):
+                snapshot = Snapshot.load(checkpoint)
+                if snapshot.members != members:
+                    raise ValueError(f"{checkpoint} was saved with members={snapshot.members}")
+                self.restore(snapshot)
+                start = snapshot.step
+        recorder = Recorder(stride, reduce)
+        profiler = self.profiler
+        columns = None
+        plan = None
+        integrator = None
+        active = None #schedule compiled against plan
+        try:
+            for step in range(start, nsteps + 1):
+                if step == nsteps:
+                    row = recorder.flush()
+                else:
+                    if profiler is not None:
+                        profiler.push('step')
+                    if schedule is not None:
+                        if plan is None or self.plan is not plan:
+                            plan = self.compile()
+                            integrator = None
+                        if active is None or active.plan is not plan:
+                            active = schedule.compile(self)
+                        active.apply(step * timestep, timestep)
+                    if(apply):
+                        if profiler is not None:
+                            profiler.push('apply')
+                            apply(self, step)
+                            profiler.pop()
+                        else:
+                            apply(self, step)
+                    if plan is None or self.plan is not plan or integrator is None:
+                        plan = self.compile()
+                        plan.setRates(self._rateSteps(plan, timestep), self.rateMode)
+                        integrator = Integrator(plan, method, rtol=rtol, atol=atol)
+                        if columns is None:
+                            columns = plan.resolve(record)
+                            for sink in sinks:
+                                sink.open(columns, timestep * stride, members, start // stride)
+                        rows = np.array([plan.index[name] for name in columns], dtype=int)
+                    plan.clock = step
+                    if profiler is not None:
+                        profiler.push('evaluate')
+                        plan.step()
+                        profiler.pop()
+                    else:
+                        plan.step()
+                    row = recorder.add(step, plan.values, rows)
+                if row is not None:
+                    first, values = row
+                    sample = Sample(first, first * timestep, columns, values.T if members else values)
+                    for sink in sinks:
+                        sink.write(sample)
+                    yield sample
+                if step < nsteps:
+                    if profiler is not None:
+                        profiler.push('integrate')
+                        integrator.advance(timestep)
+                        profiler.pop()
+                        profiler.steps.append(profiler.pop())
+                    else:
+                        integrator.advance(timestep)
+                    if checkpoint is not None and (step + 1) % every == 0 and step + 1 < nsteps:
+                        # Every row before the checkpoint is on disk before it is
+                        for sink in sinks:
+                            sink.flush()
+                        snapshot = self.snapshot()
+                        snapshot.step = step + 1
+                        snapshot.save(checkpoint)
+            if checkpoint is not None and os.path.exists(checkpoint):
+                os.remove(checkpoint)
+        finally:
+            if plan is not None:
+                plan.clock = None
+            for sink in sinks:
+                sink.close()
+            if profiler is not None:
+                profiler.unwind()
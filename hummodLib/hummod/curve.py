@@ -0,0 +1,98 @@
+import re
+from bisect import bisect_right
+
+import numpy as np
+
+
+# HumMod curves are lists of (x, y, slope) points joined by cubic Hermite segments.
+# Segment coefficients are computed once so evaluation is a lookup plus a Horner step.
+
+_POINT = re.compile(r'\(([^()]*)\)')
+
+
+class Curve:
+    kind = 'curve'
+
+    def __init__(self, points):
+        points = sorted((float(x), float(y), float(s)) for x, y, s in points)
+        if not points:
+            raise ValueError("Curve needs at least one point")
+        self.points = points
+        xs = np.array([p[0] for p in points])
+        ys = np.array([p[1] for p in points])
+        ms = np.array([p[2] for p in points])
+        if len(points) == 1:
+            # A single point is a line through it with the given slope
+            self.xs = xs
+            self.coeffs = np.array([[ys[0]], [ms[0]], [0.0], [0.0]])
+        else:
+            h = np.diff(xs)
+            if np.any(h <= 0):
+                raise ValueError("Curve points must have distinct x values")
+            delta = np.diff(ys) / h
+            c2 = (3 * delta - 2 * ms[:-1] - ms[1:]) / h
+            c3 = (ms[:-1] + ms[1:] - 2 * delta) / (h * h)
+            self.xs = xs[:-1]
+            self.coeffs = np.array([ys[:-1], ms[:-1], c2, c3])
+        # Plain python copies for the scalar path, numpy is slower for one point
+        self._xs = self.xs.tolist()
+        self._coeffs = list(zip(*self.coeffs.tolist()))
+
+    @classmethod
+    def table(cls, points, segments):
+        #From bundle table rows: points (x, y, slope) and segments (x, c0, c1, c2, c3) as __init__
+        #computes them. Nothing is sorted or recomputed, the arrays stay views of the table
+        curve = cls.__new__(cls)
+        curve.points = points
+        curve.xs = segments[:, 0]
+        curve.coeffs = segments[:, 1:].T
+        return curve
+
+    def segments(self):
+        #(x, c0, c1, c2, c3) rows, see table
+        return np.column_stack([self.xs, self.coeffs.T])
+
+    def __getattr__(self, name):
+        # Scalar copies of a curve made by table, on its first scalar call
+        if name in ('_xs', '_coeffs') and 'xs' in self.__dict__:
+            self._xs = self.xs.tolist()
+            self._coeffs = list(zip(*self.coeffs.tolist()))
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    @classmethod
+    def parse(cls, func_def):
+        # Parses '<CURVE((0.0,1.0,0.0),(3.3,0.0,0.0))>' with any number of points
+        if not (func_def.startswith('<CURVE(') and func_def.endswith(')>')):
+            raise ValueError(f"Not a curve: {func_def}")
+        points = []
+        for point in _POINT.findall(func_def[7:-2]):
+            coords = [float(c) for c in point.split(',')]
+            if len(coords) != 3:
+                raise ValueError(f"Curve point needs x, y and slope: ({point})")
+            points.append(coords)
+        return cls(points)
+
+    def __call__(self, x):
+        if isinstance(x, np.ndarray):
+            return self.evaluate(x)
+        x = float(x)
+        i = bisect_right(self._xs, x) - 1
+        if i < 0:
+            i = 0
+        c0, c1, c2, c3 = self._coeffs[i]
+        t = x - self._xs[i]
+        return ((c3 * t + c2) * t + c1) * t + c0
+
+    def evaluate(self, x):
+        # Vectorized evaluation over an array of x values.
+        # Outside the points the end segments are extrapolated, like CubicSpline did.
+        x = np.asarray(x, dtype=float)
+        i = np.searchsorted(self.xs, x, side='right') - 1
+        np.clip(i, 0, len(self.xs) - 1, out=i)
+        t = x - self.xs[i]
+        c0, c1, c2, c3 = self.coeffs[:, i]
+        return ((c3 * t + c2) * t + c1) * t + c0
+
+    def __repr__(self):
+        return f"Curve({self.points})"
@@ -0,0 +1,326 @@
+import math
+import re
+from functools import lru_cache
+
+import numpy as np
+
+
+# Definition strings are parsed once into trees of plain tuples (so they marshal
+# into bundles) and compiled on first use into two python functions, one for
+# scalars and one for numpy arrays of ensemble members.
+#
+#   numbers           1, 0.5, 2.5E-3
+#   references        Area, Heart-Ventricles.Rate (module names may hold dashes)
+#   curves            Effect [ Area ]
+#   arithmetic        + - * / ^
+#   comparisons       > < >= <= == != (or GT LT GE LE EQ NE)
+#   logic             AND OR NOT
+#   functions         IF(test, then, else) MIN MAX ABS EXP LOG LOG10 SQRT
+#
+# Trees: ('num', value) ('ref', name) ('curve', name, arg) ('call', name, args)
+#        ('neg', arg) ('not', arg) ('op', operator, left, right)
+#        ('error', message) for a definition that does not parse, raised when evaluated
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+      (?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<name>[A-Za-z_]\w*(?:-[A-Za-z_]\w*)*\.[A-Za-z_]\w*|[A-Za-z_]\w*)
+    | (?P<op>>=|<=|==|!=|[-+*/^()\[\],<>=])
+    )""", re.VERBOSE)
+
+_WORDS = {'GT': '>', 'LT': '<', 'GE': '>=', 'LE': '<=', 'EQ': '==', 'NE': '!=', 'AND': 'and', 'OR': 'or', 'NOT': 'not'}
+_COMPARE = ('>', '<', '>=', '<=', '==', '!=')
+_FUNCTIONS = {'IF': 3, 'MIN': None, 'MAX': None, 'ABS': 1, 'EXP': 1, 'LOG': 1, 'LN': 1, 'LOG10': 1, 'SQRT': 1}
+
+_SCALAR = {'EXP': '_exp', 'LOG': '_log', 'LN': '_log', 'LOG10': '_log10', 'SQRT': '_sqrt',
+           'ABS': 'abs', 'MIN': 'min', 'MAX': 'max', '^': '_pow'}
+_BATCHED = {'EXP': 'np.exp', 'LOG': 'np.log', 'LN': 'np.log', 'LOG10': 'np.log10', 'SQRT': 'np.sqrt',
+            'ABS': 'np.abs', 'MIN': 'np.minimum', 'MAX': 'np.maximum', '^': 'np.power'}
+
+
+# The scalar path gives what the batched one does where math raises: a division by 0
+# is +-inf (nan for 0 / 0), SQRT or LOG out of their domain nan or -inf, and an EXP or
+# ^ too large inf. The math functions stay the fast path, numpy only answers failures.
+
+def _numpy(fn, fallback):
+    def call(*args):
+        try:
+            return fn(*args)
+        except (ArithmeticError, ValueError):
+            with np.errstate(all='ignore'):
+                return float(fallback(*args))
+    return call
+
+
+_div = _numpy(lambda a, b: a / b, np.divide)
+_exp = _numpy(math.exp, np.exp)
+_log = _numpy(math.log, np.log)
+_log10 = _numpy(math.log10, np.log10)
+_sqrt = _numpy(math.sqrt, np.sqrt)
+_pow = _numpy(math.pow, lambda a, b: np.power(float(a), float(b)))
+_HELPERS = {'_div': _div, '_exp': _exp, '_log': _log, '_log10': _log10, '_sqrt': _sqrt, '_pow': _pow}
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Unexpected {text[position:].strip()[:10]!r} in {text!r}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'name' and value.upper() in _WORDS:
+            kind, value = 'op', _WORDS[value.upper()]
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    # Recursive descent, loosest binding first: OR, AND, NOT, comparisons, + -, * /, unary -, ^
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i][1] if self.i < len(self.tokens) else None
+
+    def take(self, expected=None):
+        if self.i >= len(self.tokens):
+            raise ValueError(f"Unexpected end of {self.text!r}")
+        kind, value = self.tokens[self.i]
+        if expected is not None and value != expected:
+            raise ValueError(f"Expected {expected!r} but found {value!r} in {self.text!r}")
+        self.i += 1
+        return kind, value
+
+    def parse(self):
+        tree = self.logic('or')
+        if self.i < len(self.tokens):
+            raise ValueError(f"Unexpected {self.peek()!r} in {self.text!r}")
+        return tree
+
+    def logic(self, op):
+        operand = (lambda: self.logic('and')) if op == 'or' else self.negation
+        left = operand()
+        while self.peek() == op:
+            self.take()
+            left = ('op', op, left, operand())
+        return left
+
+    def negation(self):
+        if self.peek() == 'not':
+            self.take()
+            return ('not', self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        left = self.binary(0)
+        while self.peek() in _COMPARE or self.peek() == '=':
+            op = self.take()[1]
+            left = ('op', '==' if op == '=' else op, left, self.binary(0))
+        return left
+
+    def binary(self, level):
+        ops = (('+', '-'), ('*', '/'))[level]
+        operand = (lambda: self.binary(1)) if level == 0 else self.unary
+        left = operand()
+        while self.peek() in ops:
+            op = self.take()[1]
+            left = ('op', op, left, operand())
+        return left
+
+    def unary(self):
+        if self.peek() == '-':
+            self.take()
+            return ('neg', self.unary())
+        if self.peek() == '+':
+            self.take()
+            return self.unary()
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() == '^':
+            self.take()
+            # Right associative and binds tighter than a unary minus on its left
+            return ('op', '^', base, self.unary())
+        return base
+
+    def atom(self):
+        kind, value = self.take()
+        if kind == 'num':
+            return ('num', float(value))
+        if value == '(':
+            tree = self.logic('or')
+            self.take(')')
+            return tree
+        if kind != 'name':
+            raise ValueError(f"Unexpected {value!r} in {self.text!r}")
+        if self.peek() == '[':
+            self.take()
+            arg = self.logic('or')
+            self.take(']')
+            return ('curve', value, arg)
+        if self.peek() == '(':
+            name = value.upper()
+            if name not in _FUNCTIONS:
+                raise ValueError(f"Unknown function {value} in {self.text!r}")
+            self.take()
+            args = [self.logic('or')]
+            while self.peek() == ',':
+                self.take()
+                args.append(self.logic('or'))
+            self.take(')')
+            arity = _FUNCTIONS[name]
+            if (arity is not None and len(args) != arity) or len(args) == 0:
+                raise ValueError(f"{value} takes {arity} arguments in {self.text!r}")
+            return ('call', name, tuple(args))
+        return ('ref', value)
+
+
+@lru_cache(maxsize=4096)
+def parse(text):
+    #Parses a definition string into a tree of tuples, shared by equal strings
+    return _Parser(text).parse()
+
+
+def references(tree, found=None):
+    #Names the tree reads, in order of first use
+    if found is None:
+        found = []
+    kind = tree[0]
+    if kind == 'ref':
+        if tree[1] not in found:
+            found.append(tree[1])
+    elif kind == 'curve':
+        references(tree[2], found)
+    elif kind == 'call':
+        for arg in tree[2]:
+            references(arg, found)
+    elif kind in ('neg', 'not'):
+        references(tree[1], found)
+    elif kind == 'op':
+        references(tree[2], found)
+        references(tree[3], found)
+    return found
+
+
+class Expression:
+    # Compiled definition. Called with the values of self.names in order,
+    # numpy arrays take the batched path like Curve does.
+    kind = 'expression'
+
+    def __init__(self, tree, curves, bind=None, text=None):
+        #bind: name -> name the argument is read from, or a float to fold in its place
+        self.tree = tree
+        self.text = text
+        self.curves = curves
+        bind = bind or {}
+        self.names = tuple(bind.get(name, name) for name in references(tree)
+                           if not isinstance(bind.get(name), float))
+        self._bind = bind
+        self._scalar = None
+        self._batched = None
+
+    @classmethod
+    def parse(cls, text, curves, bind=None):
+        return cls(parse(text), curves, bind, text)
+
+    @classmethod
+    def bound(cls, tree, curves, bind, names, text=None):
+        #With names already resolved from bind (a bundled ModulePlan), the tree is not walked
+        expression = cls.__new__(cls)
+        expression.tree = tree
+        expression.text = text
+        expression.curves = curves
+        expression.names = names
+        expression._bind = bind
+        expression._scalar = None
+        expression._batched = None
+        return expression
+
+    def __call__(self, *args):
+        for arg in args:
+            if isinstance(arg, np.ndarray):
+                return self.batched(*args)
+        return self.scalar(*args)
+
+    @property
+    def scalar(self):
+        if self._scalar is None:
+            self._scalar = self._compile(False)
+        return self._scalar
+
+    @property
+    def batched(self):
+        if self._batched is None:
+            self._batched = self._compile(True)
+        return self._batched
+
+    def evaluate(self, *args):
+        #Batched evaluation over arrays of ensemble members
+        return self.batched(*[np.asarray(arg, dtype=float) for arg in args])
+
+    def _compile(self, batched):
+        arguments = {name: f"a{i}" for i, name in enumerate(self.names)}
+        env = {'math': math, 'np': np, **_HELPERS}
+        body = self._source(self.tree, batched, arguments, env)
+        if batched:
+            # nan and inf where numpy would warn, the same values the scalar path gives
+            source = (f"def evaluate({', '.join(arguments.values())}):\n"
+                      f"    with np.errstate(all='ignore'):\n        return {body}\n")
+        else:
+            source = f"def evaluate({', '.join(arguments.values())}):\n    return {body}\n"
+        exec(compile(source, f"<{self.text or 'expression'}>", 'exec'), env)
+        return env['evaluate']
+
+    def _source(self, tree, batched, arguments, env):
+        kind = tree[0]
+        if kind == 'num':
+            return repr(tree[1])
+        if kind == 'ref':
+            bound = self._bind.get(tree[1], tree[1])
+            return repr(bound) if isinstance(bound, float) else arguments[bound]
+        if kind == 'error':
+            raise ValueError(tree[1])
+        functions = _BATCHED if batched else _SCALAR
+        if kind == 'curve':
+            if tree[1] not in self.curves:
+                raise ValueError(f"{tree[1]} is not a curve in {self.text!r}")
+            name = f"c{len(env)}"
+            env[name] = self.curves[tree[1]].evaluate if batched else self.curves[tree[1]]
+            return f"{name}({self._source(tree[2], batched, arguments, env)})"
+        if kind == 'neg':
+            return f"(-{self._source(tree[1], batched, arguments, env)})"
+        if kind == 'not':
+            arg = self._source(tree[1], batched, arguments, env)
+            return f"np.logical_not({arg})" if batched else f"({arg} == 0)"
+        if kind == 'call':
+            args = [self._source(arg, batched, arguments, env) for arg in tree[2]]
+            if tree[1] == 'IF':
+                test, then, other = args
+                return f"np.where({test}, {then}, {other})" if batched else f"({then} if {test} else {other})"
+            if tree[1] in ('MIN', 'MAX') and (batched or len(args) == 1):
+                # numpy's minimum and maximum take two operands
+                source = args[0]
+                for arg in args[1:]:
+                    source = f"{functions[tree[1]]}({source}, {arg})"
+                return source
+            return f"{functions[tree[1]]}({', '.join(args)})"
+        op, left, right = tree[1], self._source(tree[2], batched, arguments, env), self._source(tree[3], batched, arguments, env)
+        if op == '^':
+            return f"{functions['^']}({left}, {right})"
+        if op in ('and', 'or'):
+            if batched:
+                return f"np.logical_{op}({left}, {right})"
+            return f"({left} != 0 {op} {right} != 0)"
+        if op == '/' and not batched:
+            return f"_div({left}, {right})"
+        return f"({left} {op} {right})"
+
+    def __repr__(self):
+        return f"Expression({self.text!r})" if self.text else f"Expression({self.tree})"
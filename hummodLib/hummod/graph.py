@@ -0,0 +1,119 @@
+import json
+
+import numpy as np
+
+
+def scc(nodes, edges):
+    # Iterative Tarjan. edges(node) -> successors. Returns the strongly connected
+    # components as lists, every component after all the components it reaches.
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+    for root in nodes:
+        if root in index:
+            continue
+        work = [(root, iter(edges(root)))]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, successors = work[-1]
+            advanced = False
+            for succ in successors:
+                if succ not in index:
+                    index[succ] = low[succ] = counter
+                    counter += 1
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(edges(succ))))
+                    advanced = True
+                    break
+                if succ in on_stack:
+                    low[node] = min(low[node], index[succ])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component[::-1])
+    return components
+
+
+class DependencyIndex:
+    # Transitive dependencies of a graph, built in one pass over its condensation.
+    # Each component stores the nodes it reaches as a packed bitset row, so
+    # dependsOn is a bit test and closure an unpack of one row.
+    def __init__(self, edges):
+        #edges: {node: [nodes it depends on]}, edges to unknown nodes are ignored
+        self.names = list(edges)
+        self.position = {name: i for i, name in enumerate(self.names)}
+        successors = [[self.position[d] for d in dict.fromkeys(edges[name]) if d in self.position] for name in self.names]
+        components = scc(range(len(self.names)), lambda i: successors[i])
+
+        n = len(self.names)
+        self.component = np.empty(n, dtype=np.int64)
+        for c, members in enumerate(components):
+            self.component[members] = c
+        self.cyclic = np.zeros(len(components), dtype=bool)
+        self.reach = np.zeros((len(components), (n + 7) // 8), dtype=np.uint8)
+        members_bits = np.zeros_like(self.reach)
+        for c, members in enumerate(components):
+            bits = np.zeros(n, dtype=bool)
+            bits[members] = True
+            members_bits[c] = np.packbits(bits)
+            self.cyclic[c] = len(members) > 1 or members[0] in successors[members[0]]
+        # Components come sinks first, so every successor row is final when it is read
+        for c, members in enumerate(components):
+            row = self.reach[c]
+            for d in {int(self.component[s]) for m in members for s in successors[m]}:
+                if d != c:
+                    row |= self.reach[d]
+                    row |= members_bits[d]
+            if self.cyclic[c]:
+                row |= members_bits[c]
+
+    @classmethod
+    def fromMap(cls, path="map.json"):
+        #Index over the structure names of a map.json
+        with open(path) as f:
+            dependencyMap = json.load(f)
+        return cls({file[:-4] if file.endswith(".DES") else file: data["dependencies"]
+                    for file, data in dependencyMap.items()})
+
+    def _row(self, name):
+        return self.reach[self.component[self.position[name]]]
+
+    def dependsOn(self, a, b):
+        #True when a transitively depends on b
+        j = self.position[b]
+        return bool(self._row(a)[j >> 3] & (0x80 >> (j & 7)))
+
+    def closure(self, name):
+        #Every node name transitively depends on, itself only when it sits on a cycle
+        bits = np.unpackbits(self._row(name), count=len(self.names))
+        return {self.names[i] for i in np.flatnonzero(bits)}
+
+    def closureSize(self, name):
+        return int(np.unpackbits(self._row(name), count=len(self.names)).sum())
+
+    def closureSums(self, weights, includeSelf=False):
+        #For every node, the sum of weights over its closure, in self.names order
+        weights = np.asarray(weights)
+        bits = np.unpackbits(self.reach, axis=1, count=len(self.names))
+        sums = (bits @ weights)[self.component]
+        if includeSelf:
+            sums = sums + np.where(self.cyclic[self.component], 0, weights)
+        return sums
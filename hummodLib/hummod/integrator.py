@@ -0,0 +1,172 @@
+import numpy as np
+
+
+# Integrates the DFQ state variables of a plan. All states live in plan.values
+# at plan.states, their derivatives at plan.derivs, so the state vector is one
+# fancy index away. Works the same for single runs and ensembles.
+
+# Dormand-Prince 5(4) tableau
+_DP_C = (0.0, 1/5, 3/10, 4/5, 8/9, 1.0, 1.0)
+_DP_A = (
+    (),
+    (1/5,),
+    (3/40, 9/40),
+    (44/45, -56/15, 32/9),
+    (19372/6561, -25360/2187, 64448/6561, -212/729),
+    (9017/3168, -355/33, 46732/5247, 49/176, -5103/18656),
+    (35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84),
+)
+_DP_E = np.array([71/57600, 0.0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40])
+
+
+class ConvergenceError(RuntimeError):
+    #An implicit step that Newton could not solve, even cut into substeps
+    pass
+
+
+class Integrator:
+    METHODS = ('euler', 'rk4', 'rk45', 'implicit')
+
+    def __init__(self, plan, method='euler', rtol=1e-3, atol=1e-6, hmin=1e-9, max_iter=10):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown integration method: {method}, expected one of {self.METHODS}")
+        self.plan = plan
+        self.method = method
+        self.rtol = rtol
+        # A DFQ's errorlim is its absolute tolerance, atol covers the others
+        atol = np.where(np.isnan(plan.errorlims), atol, plan.errorlims)
+        self.atol = atol if plan.values.ndim == 1 else atol[:, None]
+        self.hmin = hmin
+        self.max_iter = max_iter
+        self.h = None #Last adaptive step size, carried between calls
+        self.jacobian = None #Last implicit Jacobian, (members, n, n)
+        self.evaluations = 0
+
+    def derivatives(self, y):
+        #Evaluates the plan at state y and returns the derivatives
+        plan = self.plan
+        plan.values[plan.states] = y
+        plan.step()
+        self.evaluations += 1
+        return plan.values[plan.derivs]
+
+    def advance(self, dt):
+        #Moves the state forward by dt. Expects plan values to be current for the state
+        plan = self.plan
+        if not len(plan.states):
+            return
+        y = plan.values[plan.states]
+        f = plan.values[plan.derivs]
+        y = getattr(self, '_' + self.method)(y, f, dt)
+        plan.values[plan.states] = y
+        plan.moved = True
+
+    def _euler(self, y, f, dt):
+        return y + dt * f
+
+    def _rk4(self, y, f, dt):
+        k2 = self.derivatives(y + dt / 2 * f)
+        k3 = self.derivatives(y + dt / 2 * k2)
+        k4 = self.derivatives(y + dt * k3)
+        return y + dt / 6 * (f + 2 * k2 + 2 * k3 + k4)
+
+    def _rk45(self, y, f, dt):
+        # Adaptive Dormand-Prince, the step size is kept between output steps
+        # so slow stretches are crossed in a few large steps
+        t = 0.0
+        h = min(self.h or dt, dt)
+        while t < dt:
+            h = min(h, dt - t)
+            k = [f]
+            for i in range(1, 7):
+                yi = y + h * sum(a * kj for a, kj in zip(_DP_A[i], k) if a)
+                k.append(self.derivatives(yi))
+            y_new = yi
+            err = h * sum(e * kj for e, kj in zip(_DP_E, k) if e)
+            scale = self.atol + self.rtol * np.maximum(np.abs(y), np.abs(y_new))
+            norm = float(np.sqrt(np.mean((err / scale) ** 2)))
+            if norm <= 1.0 or h <= self.hmin:
+                t += h
+                y, f = y_new, k[6]
+            factor = 5.0 if norm == 0 else min(5.0, max(0.2, 0.9 * norm ** -0.2))
+            h = max(self.hmin, h * factor)
+        self.h = h
+        return y
+
+    def _implicit(self, y, f, dt):
+        # Backward Euler. Stable for stiff states at steps far beyond the explicit limit.
+        # The finite difference Jacobian is kept between steps and, like Loop does, only
+        # retaken when Newton stops converging with it. A step Newton cannot solve is cut
+        # into halves, halves of those and so on down to hmin before giving up.
+        shape = y.shape
+        y0 = y.reshape(len(y), -1)
+        f0 = f.reshape(y0.shape)
+        if self.jacobian is not None and self.jacobian.shape[0] != y0.shape[1]:
+            self.jacobian = None
+        t = 0.0
+        h = dt
+        while t < dt:
+            h = min(h, dt - t)
+            y1, f1, converged = self._newton(y0, f0, h, shape)
+            if converged:
+                t += h
+                y0, f0 = y1, f1
+                h *= 2
+            elif h / 2 >= self.hmin:
+                h /= 2
+            else:
+                raise ConvergenceError(f"Implicit step did not converge, not even in substeps of {h:.3g} min "
+                                       f"at {t:.6g} min into a step of {dt:.6g}")
+        return y0.reshape(shape)
+
+    def _jacobian(self, y0, f0, shape):
+        # (members, n, n), one evaluation per state
+        n, members = y0.shape
+        jac = np.empty((members, n, n))
+        eps = np.sqrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(y0))
+        for j in range(n):
+            yp = y0.copy()
+            yp[j] += eps[j]
+            jac[:, :, j] = ((self.derivatives(yp.reshape(shape)).reshape(y0.shape) - f0) / eps[j]).T
+        return jac
+
+    def _newton(self, y0, f0, dt, shape):
+        # Solves y1 = y0 + dt * f(y1) from y1 = y0, returns (y1, f(y1), converged). Updates are
+        # measured against the tolerances, <= 1 has converged. One that does not shrink is thrown
+        # away and the Jacobian retaken at the last iterate, unless it was just taken there, in
+        # which case the step fails. One that shrinks too slowly to converge in the iterations
+        # left is kept, with the Jacobian retaken at it
+        n = len(y0)
+        atol = self.atol.reshape(-1, 1)
+        y1, f1 = y0, f0
+        fresh = self.jacobian is None
+        if fresh:
+            self.jacobian = self._jacobian(y1, f1, shape)
+        lhs = np.eye(n) - dt * self.jacobian
+        size = None
+        for i in range(self.max_iter):
+            g = y1 - y0 - dt * f1
+            try:
+                delta = np.linalg.solve(lhs, -g.T[:, :, None])[:, :, 0].T
+            except np.linalg.LinAlgError:
+                delta = np.full(y1.shape, np.nan)
+            trial = y1 + delta
+            f_trial = self.derivatives(trial.reshape(shape)).reshape(y0.shape)
+            norm = float(np.max(np.abs(delta) / (atol + self.rtol * np.abs(trial))))
+            if not (np.isfinite(norm) and np.all(np.isfinite(f_trial))) or (size is not None and norm >= size):
+                if fresh:
+                    return y1, f1, False
+                retake = True
+            else:
+                y1, f1 = trial, f_trial
+                fresh = False
+                if norm <= 1.0:
+                    return y1, f1, True
+                retake = size is not None and norm * (norm / size) ** (self.max_iter - i - 1) > 1.0
+                size = norm
+            if retake:
+                self.jacobian = self._jacobian(y1, f1, shape)
+                lhs = np.eye(n) - dt * self.jacobian
+                fresh = True
+                size = None
+        return y1, f1, False
@@ -0,0 +1,157 @@
+import heapq
+
+import numpy as np
+
+from .graph import scc
+
+
+# Algebraic loops: ops that read each other's targets within one step, with no
+# integration in between. The ops are grouped into strongly connected components
+# and the components ordered like a topological sort. A component with a cycle
+# runs as one Loop: the members that are read before they are computed (the
+# tears) are solved for x = g(x), where g runs the member ops once.
+
+def schedule(ops):
+    #Returns the ops in evaluation order and (start, stop, tears) of every loop,
+    #start and stop being positions in that order. Ties keep the incoming order.
+    position = {op[0]: i for i, op in enumerate(ops)}
+    reads = [sorted({position[a] for a in set(args) if a in position}) for target, fn, args in ops]
+    components = scc(range(len(ops)), lambda i: reads[i])
+    component = [0] * len(ops)
+    for c, members in enumerate(components):
+        for i in members:
+            component[i] = c
+
+    # Kahn over the condensation, the component holding the earliest op first
+    waiting = [0] * len(components)
+    dependents = [set() for _ in components]
+    for i, deps in enumerate(reads):
+        for j in deps:
+            if component[i] != component[j] and component[i] not in dependents[component[j]]:
+                dependents[component[j]].add(component[i])
+                waiting[component[i]] += 1
+    ready = [(min(members), c) for c, members in enumerate(components) if waiting[c] == 0]
+    heapq.heapify(ready)
+    order = []
+    loops = []
+    while ready:
+        _, c = heapq.heappop(ready)
+        members = components[c]
+        if len(members) == 1 and members[0] not in reads[members[0]]:
+            order.append(members[0])
+        else:
+            start = len(order)
+            ordered, tears = _tear(members, reads)
+            order.extend(ordered)
+            loops.append((start, len(order), [ops[i][0] for i in tears]))
+        for d in dependents[c]:
+            waiting[d] -= 1
+            if waiting[d] == 0:
+                heapq.heappush(ready, (min(components[d]), d))
+    return [ops[i] for i in order], loops
+
+
+def _tear(members, reads):
+    # Orders a cyclic component greedily: the earliest op whose reads are all done,
+    # or failing that the op with the fewest pending reads. What is read before it
+    # is computed becomes a tear.
+    pending = set(members)
+    ordered = []
+    tears = []
+    while pending:
+        best = min(pending, key=lambda i: (sum(1 for j in reads[i] if j in pending and j != i), i))
+        for j in reads[best]:
+            if j in pending and j not in tears:
+                tears.append(j)
+        pending.discard(best)
+        ordered.append(best)
+    return ordered, tears
+
+
+class Loop:
+    # Solves the tears of one component of plan.ops[start:stop]. 'newton' uses a
+    # finite difference Jacobian that is kept between solves and only retaken when
+    # an iteration fails to shrink the residual, 'relax' is x += relaxation * (g(x) - x).
+    # Ensembles are solved for every member at once, each with its own Jacobian.
+    def __init__(self, start, stop, tears, names=(), method='newton', rtol=1e-8, atol=1e-10, max_iter=50,
+                 relaxation=1.0):
+        self.start = start
+        self.stop = stop
+        self.tears = list(tears)
+        self.names = list(names) #Member "Module.Var" names, for display
+        self.configure(method, rtol, atol, max_iter, relaxation)
+        self.jacobian = None
+        self.solves = 0
+        self.iterations = 0 #Evaluations of the member ops, Jacobian columns included
+        self.failures = 0 #Solves that stopped at max_iter, keeping the last iterate
+
+    def configure(self, method='newton', rtol=1e-8, atol=1e-10, max_iter=50, relaxation=1.0):
+        if method not in ('newton', 'relax'):
+            raise ValueError(f"Unknown loop method: {method}, expected 'newton' or 'relax'")
+        self.method = method
+        self.rtol = rtol
+        self.atol = atol
+        self.max_iter = max_iter
+        self.relaxation = relaxation
+        self.jacobian = None
+
+    def _run(self, v, ops, pinned):
+        for target, fn, args in ops[self.start:self.stop]:
+            if target not in pinned:
+                v[target] = fn(*[v[a] for a in args])
+        self.iterations += 1
+
+    def solve(self, v, ops, pinned):
+        self.solves += 1
+        tears = [t for t in self.tears if t not in pinned]
+        if not tears:
+            self._run(v, ops, pinned)
+            return
+        if self.jacobian is not None and self.jacobian[0] != tears:
+            self.jacobian = None
+        x = v[tears].copy()
+        self._run(v, ops, pinned)
+        residual = v[tears] - x
+        size = None
+        for _ in range(self.max_iter):
+            g = x + residual
+            if np.all(np.abs(residual) <= self.atol + self.rtol * np.abs(g)):
+                return
+            if self.method == 'relax':
+                x = x + self.relaxation * residual
+            else:
+                norm = float(np.max(np.abs(residual)))
+                if self.jacobian is None or (size is not None and norm >= size):
+                    self.jacobian = (tears, self._jacobian(v, ops, pinned, tears, x, residual))
+                size = norm
+                x = x + self._newton(self.jacobian[1], residual)
+            v[tears] = x
+            self._run(v, ops, pinned)
+            residual = v[tears] - x
+        self.failures += 1
+
+    def _jacobian(self, v, ops, pinned, tears, x, residual):
+        # d(g(x) - x)/dx by forward differences, (k, k) or (members, k, k)
+        k = len(tears)
+        jac = np.empty(x.shape[1:] + (k, k))
+        eps = np.sqrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(x))
+        for j in range(k):
+            xp = x.copy()
+            xp[j] += eps[j]
+            v[tears] = xp
+            self._run(v, ops, pinned)
+            jac[..., :, j] = ((v[tears] - xp - residual) / eps[j]).T
+        return jac
+
+    def _newton(self, jac, residual):
+        try:
+            if residual.ndim == 1:
+                return np.linalg.solve(jac, -residual)
+            return np.linalg.solve(jac, -residual.T[:, :, None])[:, :, 0].T
+        except np.linalg.LinAlgError:
+            # Singular, fall back to a relaxation step and retake it next time
+            self.jacobian = None
+            return self.relaxation * residual
+
+    def __repr__(self):
+        return f"Loop({', '.join(self.names)}, tears {self.tears})"
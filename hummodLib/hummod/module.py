@@ -1,30 +1,159 @@
 
+import copy
 import json
 import os
-import re
 import logging
-from scipy.interpolate import CubicSpline
+from .bundle import Bundle
+from .curve import Curve
+from .expression import parse
+from .plan import ModulePlan
+from .registry import registry
 
+STRUCTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'structures')
+
+
+def source(client, name):
+    #Registry key of a structure: the bundle it is in, or its JSON file and modification time
+    bundle = client.bundle
+    if bundle is not None and name in bundle:
+        return ('bundle', bundle.path, name)
+    path = os.path.abspath(os.path.join(client.structures or STRUCTURES, f'{name}.json'))
+    return ('json', path, os.stat(path).st_mtime_ns)
+
+
+def _parse(text, module, target):
+    # A definition that does not parse fails where it is evaluated, not its whole module
+    if not isinstance(text, str):
+        return ('error', f"{module}.{target}: {text!r} is not a definition")
+    try:
+        return parse(text)
+    except ValueError as error:
+        return ('error', f"{module}.{target}: {error}")
+
+
+class _Cycle(Exception):
+    pass
+
+
+#Parsed definition of a structure. Never changed after loading, so one is shared
+#by every client in the process through the registry
+
+class Structure:
+    __slots__ = ('data', 'curves', 'definitions', 'blocks', 'variables', 'dfqs', 'plan')
+
+    def __init__(self, key):
+        if key[0] == 'bundle':
+            #Precompiled, nothing is parsed or compiled
+            (self.data, self.curves, self.definitions, self.blocks, self.variables, self.dfqs,
+             plan) = Bundle.open(key[1]).load(key[2])
+            self.plan = ModulePlan.restore(self, plan)
+            return
+        self.data = self._load_data(key[1]) #Load the JSON data
+        self.curves = self._compile_curves() #Curve functions, parsed once
+        name = os.path.splitext(os.path.basename(key[1]))[0]
+        self.definitions, self.blocks = self._compile_definitions(name) #Parsed expressions and CALLS
+        self.variables = self._process_variables() #Variables and their calculation expressions
+        self.dfqs = self._compile_dfqs() #Integrated variables and their derivatives
+        self.plan = ModulePlan(self) #Dependency ordered evaluation plan
+
+    def vars(self):
+        return list(self.variables.keys())
+
+    def _load_data(self, file_path):
+        with open(file_path, 'r') as f:
+            return json.load(f)
+
+    def _process_variables(self):
+        # Process variables from the loaded data
+        variables = {}
+        if 'variables' in self.data:
+            for var_name, var_data in self.data['variables'].items():
+                if 'value' in var_data:
+                    variables[var_name] = var_data['value']
+        return variables
+
+    def _compile_definitions(self, name):
+        # Parses every definition once.
+        # definitions: target -> (text, parsed expression tree)
+        # blocks: name -> (CALLS, last expression, names defined in the block)
+        definitions = {}
+        blocks = {}
+
+        def walk(block_name, block):
+            calls = []
+            result = None
+            targets = []
+            for key, expr in block.items():
+                if key == 'CALLS' and isinstance(expr, list):
+                    calls.extend(expr)
+                    continue
+                if isinstance(expr, dict):
+                    walk(key, expr)
+                else:
+                    definitions[key] = (expr, _parse(expr, name, key))
+                result = expr
+                targets.append(key)
+            blocks[block_name] = (calls, result, targets)
+
+        for def_name, def_val in self.data.get('definitions', {}).items():
+            if isinstance(def_val, dict):
+                walk(def_name, def_val)
+            elif isinstance(def_val, str):
+                definitions[def_name] = (def_val, _parse(def_val, name, def_name))
+        return definitions, blocks
+
+    def _compile_curves(self):
+        curves = {}
+        for func_name, func_def in self.data.get('functions', {}).items():
+            if func_def and func_def.startswith('<CURVE('):
+                curves[func_name] = Curve.parse(func_def)
+        return curves
+
+    def _compile_dfqs(self):
+        # Parses '<DFQ(Mass,Change,0.1)>' -> (integral, derivative, errorlim)
+        dfqs = {}
+        for func_name, func_def in self.data.get('functions', {}).items():
+            if func_def and func_def.startswith('<DFQ(') and func_def.endswith(')>'):
+                parts = [p.strip() for p in func_def[5:-2].split(',')]
+                integral, deriv = parts[0], parts[1]
+                errorlim = float(parts[2]) if len(parts) > 2 and parts[2] else None
+                dfqs[func_name] = (integral, deriv, errorlim)
+        return dfqs
 
 
 #All structures are of this class
 
 class Module:
+    # Values live in the client's plan, a slice of one float64 array per module,
+    # see slot and array. values and user_set only remember what was set by hand.
+    __slots__ = ('client', 'name', 'structure', 'data', 'curves', 'definitions', 'blocks', 'variables', 'dfqs',
+                 'plan', 'values', 'user_set')
+
     def __init__(self, client, name):
         self.client = client #Parent Client
         self.name = name # Name of Structure
-        self.data = self._load_data() #Load the JSON data
-        self.variables = self._process_variables() #Variables and their calculation expressions
-        
+        self.structure = registry.get(source(client, name), Structure) #Shared with every other client
+        self.data = self.structure.data
+        self.curves = self.structure.curves
+        self.definitions = self.structure.definitions
+        self.blocks = self.structure.blocks
+        self.variables = self.structure.variables
+        self.dfqs = self.structure.dfqs
+        self.plan = self.structure.plan
+
         self.values = {} #Last calculated/manually edited values
         self.user_set = set()
 
+    def fork(self, client):
+        #Same structure for another client, only the set values are copied
+        other = copy.copy(self)
+        other.client = client
+        other.values = dict(self.values)
+        other.user_set = set(self.user_set)
+        return other
+
     def curve(self, p1_x, p1_y, p1_slope, p2_x, p2_y, p2_slope, x):
-        xs = [p1_x, p2_x]
-        ys = [p1_y, p2_y]
-        bc_type = ((1, p1_slope), (1, p2_slope))
-        cs = CubicSpline(xs, ys, bc_type=bc_type)
-        return float(cs(x))
+        return Curve([(p1_x, p1_y, p1_slope), (p2_x, p2_y, p2_slope)])(x)
     
     def vars(self):
         #returns list of variables
@@ -49,6 +178,12 @@ class Module:
     def calc(self, var_name):
         if var_name in self.user_set:
             return self.values.get(var_name)
+        plan = self.client._current
+        if plan is not None:
+            # Once compiled the plan holds the values, integrated states included
+            value = plan.get(f"{self.name}.{var_name}")
+            if value is not None:
+                return value
 
         if 'variables' in self.data and var_name in self.data['variables']:
             var_info = self.data['variables'][var_name]
@@ -59,118 +194,101 @@ class Module:
                     return float(value)
                 except (TypeError, ValueError):
                     return value
-            # If value is null, check if there's a function to compute it
-            if 'functions' in self.data and var_name in self.data['functions']:
-                # Try to get arguments from definitions
-                arg_expr = self._get_function_args_from_definitions(var_name)
-                if arg_expr:
-                    func_name, args = arg_expr
-                    # Recursively calc for args (vars/blocks)
-                    arg_vals = []
-                    for arg in args:
-                        if arg in self.data.get('variables', {}):
-                            arg_vals.append(self.calc(arg))
-                        elif arg in self.data.get('definitions', {}):
-                            arg_vals.append(self.calc(arg))
-                        else:
-                            arg_vals.append(arg)
-                    return self._apply_function(func_name, arg_vals)
-            # If value is null, no function, but is in definitions, fall through to definitions logic below
-        if 'definitions' in self.data:
-            defs = self.data['definitions']
-            if var_name in defs:
-                definition = defs[var_name]
-                # If definition is a dict, handle CALLS, function calls, and string definitions in any combination
-                if isinstance(definition, dict):
-                    result = None
-                    for key, expr in definition.items():
-                        if key == 'CALLS' and isinstance(expr, list):
-                            for call in expr:
-                                module_name, def_name = call.split('.')
-                                module = self.client.getModule(module_name)
-                                module.calc(def_name)
-                        else:
-                            result = expr
-                    return result
-
-#        if var_name in self.data['functions']: Not Sure if i need this
-#            return self._apply_function(var_name, [])
+        # Guards the recursion below against cycles. A block already running further up
+        # is skipped, a variable that depends on itself is an algebraic loop, which is
+        # answered from the compiled plan where the loop is solved.
+        key = (self.name, var_name)
+        calculating = self.client._calculating
+        if key in calculating:
+            if var_name in self.blocks:
+                return None
+            raise _Cycle(key)
+        outermost = not calculating
+        calculating.add(key)
+        try:
+            if self.client.profiler is None:
+                return self._calc(var_name)
+            return self._profiledCalc(var_name)
+        except _Cycle:
+            if not outermost:
+                raise
+        finally:
+            calculating.discard(key)
+        plan = self.client.compile()
+        if self.client.profiler is not None:
+            self.client.profiler.push('evaluate')
+            plan.step()
+            self.client.profiler.pop()
+        else:
+            plan.step()
+        if var_name in self.blocks and self.blocks[var_name][2]:
+            var_name = self.blocks[var_name][2][-1]
+        return plan.get(f"{self.name}.{var_name}")
+
+    def _calc(self, var_name):
+        expression = self.plan.expressions.get(var_name)
+        if expression is not None:
+            # Recursively calc what it reads, here or in other modules
+            return expression(*[self._read(name) for name in expression.names])
+        if var_name in self.blocks:
+            # Runs the CALLS, then every definition in the block, the last one is its value
+            calls, _, targets = self.blocks[var_name]
+            profiler = self.client.profiler
+            if profiler is not None and calls:
+                profiler.push('calls')
+            try:
+                for call in calls:
+                    module_name, def_name = call.split('.')
+                    self.client.getModule(module_name).calc(def_name)
+            finally:
+                if profiler is not None and calls:
+                    profiler.pop()
+            result = None
+            for target in targets:
+                result = self.calc(target)
+            return result
 
         return None
 
+    def _profiledCalc(self, var_name):
+        # Same as _calc, timed as ('calc', module, variable). Frames close on the _Cycle
+        # exceptions too, which unwind calcs below a run
+        profiler = self.client.profiler
+        profiler.push('calc')
+        profiler.push(self.name)
+        profiler.push(var_name)
+        try:
+            return self._calc(var_name)
+        finally:
+            profiler.pop()
+            profiler.pop()
+            profiler.pop()
+
+    def slot(self, var_name):
+        #Integer handle of a variable in client.plan.values, see HumModClient.read and write
+        return self.client.compile().ranges[self.name][0] + self.plan.position[var_name]
+
+    @property
+    def array(self):
+        #Values of vars() as a view into the plan's array, writes go straight to the plan
+        start, stop = self.client.compile().ranges[self.name]
+        return self.client.plan.values[start:stop]
+
     def set(self, var_name, value):
         #Manually set variable
         self.values[var_name] = value
         self.user_set.add(var_name)
+        plan = self.client._current
+        position = self.plan.position.get(var_name)
+        if plan is not None and position is not None and self.name in plan.ranges:
+            plan.set(plan.ranges[self.name][0] + position, value)
 
     def get(self, var_name):
-        #Returns user-set value, or calculates it if not set by user
-        if var_name in self.user_set:
-            return self.values.get(var_name)
-        else:
-            return self.calc(var_name)
+        #Returns user-set value, or the current one, see calc
+        return self.calc(var_name)
 
-    def _load_data(self):
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        file_path = os.path.join(base_dir, 'structures', f'{self.name}.json')
-
-        with open(file_path, 'r') as f:
-            return json.load(f)
-
-    def _process_variables(self):
-        # Process variables from the loaded data
-        variables = {}
-        if 'variables' in self.data:
-            for var_name, var_data in self.data['variables'].items():
-                if 'value' in var_data:
-                    variables[var_name] = var_data['value']
-        return variables
-
-    def _parse_function_call(self, expr):
-        # Parses expressions like 'Effect [ Area ]' -> ('Effect', ['Area'])
-        match = re.match(r'([A-Za-z0-9_\-]+)\s*\[([^\]]*)\]', expr)
-        if match:
-            func_name = match.group(1).strip()
-            args = [a.strip() for a in match.group(2).split(',') if a.strip()]
-            return func_name, args
-        return expr.strip(), []
-
-    def _get_function_args_from_definitions(self, var_name):
-        # Looks for a definition that calls this function
-        if 'definitions' in self.data:
-            for def_name, def_val in self.data['definitions'].items():
-                if isinstance(def_val, dict):
-                    for key, expr in def_val.items():
-                        func_name, args = self._parse_function_call(expr)
-                        if func_name == var_name:
-                            return func_name, args
-                elif isinstance(def_val, str):
-                    func_name, args = self._parse_function_call(def_val)
-                    if func_name == var_name:
-                        return func_name, args
-        return None
-
-    def _apply_function(self, func_name, args):
-        # Get the function definition
-        func_def = self.data['functions'][func_name]
-        if func_def and func_def.startswith('<CURVE(') and func_def.endswith(')>'):
-            # Parse CURVE expression: <CURVE((0.0,1.0,0.0),(3.3,0.0,0.0))>
-            curve_content = func_def[7:-2]  # Remove '<CURVE(' and ')>'
-            # Parse the two tuples
-            tuples = curve_content.split('),(')
-            if len(tuples) == 2:
-                tuple1 = tuples[0].strip('(')
-                tuple2 = tuples[1].strip(')')
-                coords1 = [float(x.strip()) for x in tuple1.split(',')]
-                coords2 = [float(x.strip()) for x in tuple2.split(',')]
-                # Get the x value from args (should be the first argument)
-                x_value = args[0] if args else 0.0
-                # If x_value is not a float, try to convert
-                try:
-                    x_value = float(x_value)
-                except Exception:
-                    x_value = 0.0
-                return self.curve(float(coords1[0]), float(coords1[1]), float(coords1[2]),
-                           float(coords2[0]), float(coords2[1]), float(coords2[2]), x_value)
-        # For other function types like DFQs, return 0 for now
-        return 0
+    def _read(self, name):
+        if '.' in name:
+            module_name, var = name.split('.', 1)
+            return self.client.getModule(module_name).calc(var)
+        return self.calc(name)
@@ -0,0 +1,498 @@
+import copy
+import fnmatch
+from time import perf_counter
+
+import numpy as np
+
+from .expression import Expression, references
+from .loops import Loop, schedule
+
+
+# Structures are compiled once into flat lists of ops: (target, fn, args).
+# A step is then a single loop writing fn(*args) into the target slot.
+
+
+class ModulePlan:
+    # Constants and ops of a single structure, using local variable names
+    def __init__(self, module):
+        variables = module.data.get('variables', {})
+        self.names = module.vars()
+        self.position = {var: i for i, var in enumerate(self.names)} # var -> offset in the module's slots
+        self.constants = {} # var -> float, or None when the value is not numeric
+        self.expressions = {} # definition target -> compiled Expression
+        for target, (text, tree) in module.definitions.items():
+            if tree[0] == 'curve' and tree[1] not in module.curves:
+                # Other function types evaluate to 0, DFQs are integrated instead
+                tree = ('num', 0.0)
+            # Unknown local names read as 0, like literals that are not numbers
+            bind = {name: 0.0 for name in references(tree) if '.' not in name and name not in variables}
+            self.expressions[target] = Expression(tree, module.curves, bind, text)
+        ops = []
+        self.depends = {} # var -> names it is computed from, "Module.Var" when in another module
+        for var in self.names:
+            value = variables[var].get('value')
+            if value is not None:
+                try:
+                    self.constants[var] = float(value)
+                except (TypeError, ValueError):
+                    self.constants[var] = None
+                continue
+            expression = self.expressions.get(var)
+            if expression is None:
+                continue
+            tree = expression.tree
+            if tree[0] == 'error':
+                # Raises its parse error once evaluated
+                ops.append((var, expression, ()))
+                self.depends[var] = []
+            elif not expression.names:
+                # Nothing to read, fold it now
+                self.constants[var] = float(expression())
+            elif tree[0] == 'curve' and tree[2][0] == 'ref':
+                # A curve of a variable, called directly
+                ops.append((var, module.curves[tree[1]], expression.names))
+                self.depends[var] = list(expression.names)
+            else:
+                ops.append((var, expression, expression.names))
+                self.depends[var] = list(expression.names)
+        self.ops, _ = schedule(ops)
+        # (integral, derivative, errorlim) of every DFQ
+        self.states = list(module.dfqs.values())
+        for integral, deriv, _ in self.states:
+            self.depends.setdefault(integral, []).append(deriv)
+        self.calls = []
+        for calls, _, _ in module.blocks.values():
+            for call in calls:
+                callee = call.split('.')[0]
+                if callee not in self.calls:
+                    self.calls.append(callee)
+        # Modules its definitions read from are loaded with it like CALLS
+        for expression in self.expressions.values():
+            for name in expression.names:
+                callee = name.split('.')[0] if '.' in name else None
+                if callee is not None and callee not in self.calls:
+                    self.calls.append(callee)
+
+    def dump(self, module):
+        #Plain tuples for a bundle record, see restore. Trees are stored only where they
+        #differ from the parsed definition
+        definitions = module.definitions
+        expressions = {target: (None if e.tree is definitions[target][1] else e.tree, e._bind, e.names)
+                       for target, e in self.expressions.items()}
+        ops = [(var, fn.kind, args) for var, fn, args in self.ops]
+        return self.names, self.constants, expressions, ops, self.depends, self.states, self.calls
+
+    @classmethod
+    def restore(cls, module, record):
+        #From dump, without binding, folding or scheduling again
+        plan = cls.__new__(cls)
+        plan.names, plan.constants, expressions, ops, plan.depends, plan.states, plan.calls = record
+        plan.position = {var: i for i, var in enumerate(plan.names)}
+        definitions = module.definitions
+        plan.expressions = {target: Expression.bound(definitions[target][1] if tree is None else tree, module.curves,
+                                                     bind, names, definitions[target][0])
+                            for target, (tree, bind, names) in expressions.items()}
+        plan.ops = [(var, module.curves[plan.expressions[var].tree[1]] if kind == 'curve' else plan.expressions[var],
+                     args) for var, kind, args in ops]
+        return plan
+
+
+def closure(client, outputs, inputs=()):
+    # Minimal set of "Module.Var" names the outputs are computed from, loading
+    # only the modules on the way. A block pulls in what it defines and CALLS.
+    required = set()
+    pending = list(outputs) + list(inputs)
+    while pending:
+        name = pending.pop()
+        if name in required:
+            continue
+        module_name, var = name.split('.', 1)
+        module = client.getModule(module_name)
+        if var in module.blocks:
+            calls, _, targets = module.blocks[var]
+            pending.extend(calls)
+            pending.extend(f"{module_name}.{target}" for target in targets)
+        elif var not in module.variables:
+            raise KeyError(f"{module_name} has no variable or block {var}")
+        pending.extend(dep if '.' in dep else f"{module_name}.{dep}" for dep in module.plan.depends.get(var, ()))
+        required.add(name)
+    return required
+
+
+class Plan:
+    # Global plan over every loaded module, values held in one float64 array.
+    # In ensemble mode each slot is a row of client.members values.
+    # When client.required is set only those variables are evaluated and recorded.
+    def __init__(self, client, previous=None):
+        #previous: plan this one replaces, see carry
+        # Load everything reachable through CALLS, depth first like calc does
+        stack = list(reversed(client.modules)) if client.required is None else []
+        seen = set()
+        while stack:
+            name = stack.pop()
+            if name not in seen:
+                seen.add(name)
+                stack.extend(reversed(client.getModule(name).plan.calls))
+
+        self.names = [] # slot -> "Module.Var"
+        self.index = {} # "Module.Var" -> slot
+        self.ranges = {} # module name -> (first slot, last slot + 1)
+        values = []
+        numeric = []
+        for name, module in client.modules.items():
+            start = len(self.names)
+            targets = {op[0] for op in module.plan.ops}
+            for var in module.plan.names:
+                qualified = f"{name}.{var}"
+                self.index[qualified] = len(self.names)
+                self.names.append(qualified)
+                value = module.plan.constants.get(var)
+                if (value is not None or var in targets) and (client.required is None or qualified in client.required):
+                    numeric.append(self.index[qualified])
+                values.append(value if value is not None else 0.0)
+            self.ranges[name] = (start, len(self.names))
+        self._owners = None # slot -> (module, var), built on first use
+        self.values = np.array(values, dtype=float)
+        if client.members:
+            self.values = np.repeat(self.values[:, None], client.members, axis=1)
+        self.numeric = numeric
+        self.columns = [self.names[i] for i in numeric]
+
+        ops = []
+        for name in self._callOrder(client.modules):
+            for target, fn, args in client.modules[name].plan.ops:
+                if client.required is not None and f"{name}.{target}" not in client.required:
+                    continue
+                ops.append((self.index[f"{name}.{target}"], fn,
+                            tuple(self.index[arg if '.' in arg else f"{name}.{arg}"] for arg in args)))
+        # Ops that read each other within a step are solved together as a Loop
+        self.ops, loops = schedule(ops)
+        self.loops = [Loop(start, stop, tears, [self.names[op[0]] for op in self.ops[start:stop]], **client.loopOptions)
+                      for start, stop, tears in loops]
+        self._loopAt = {i: loop for loop in self.loops for i in range(loop.start, loop.stop)}
+        self.targets = {op[0] for op in self.ops}
+        self.pinned = set()
+        self.active = self.ops
+
+        # State vector of every DFQ across the loaded modules
+        states = []
+        derivs = []
+        errorlims = []
+        for name, module in client.modules.items():
+            for integral, deriv, errorlim in module.plan.states:
+                if client.required is not None and f"{name}.{integral}" not in client.required:
+                    continue
+                for var in (integral, deriv):
+                    if f"{name}.{var}" not in self.index:
+                        raise ValueError(f"DFQ in {name} refers to unknown variable {var}")
+                states.append(self.index[f"{name}.{integral}"])
+                derivs.append(self.index[f"{name}.{deriv}"])
+                errorlims.append(errorlim if errorlim is not None else np.nan)
+        self.states = np.array(states, dtype=int)
+        self.derivs = np.array(derivs, dtype=int)
+        self.errorlims = np.array(errorlims, dtype=float)
+
+        # Ops reading each slot, so a set only dirties its downstream cone. Reactive steps
+        # evaluate just that, reads between steps in either mode bring it up to date
+        self.reactive = client.reactive
+        self._readers = {}
+        for i, (target, fn, args) in enumerate(self.ops):
+            for arg in set(args):
+                self._readers.setdefault(arg, []).append(i)
+        self._cones = {}
+        self._numeric = set(numeric)
+        self.stateCone = self.cone(self.states)
+        self.dirty = set(range(len(self.ops))) # Nothing has been computed yet
+        self.moved = False # The integrator changed the states since the last evaluation
+        self.initial = self.values.copy()
+        self.profiler = client.profiler
+        self._frames = None
+        # Multi-rate, see setRates. clock is the step of the run in progress, None outside runs
+        self.clock = None
+        self.setRates({})
+
+        if previous is not None:
+            self.carry(previous)
+        for name, module in client.modules.items():
+            for var in module.user_set:
+                if f"{name}.{var}" in self.index:
+                    self.set(self.index[f"{name}.{var}"], module.values[var])
+
+    def _callOrder(self, modules):
+        # Callers first, then their callees in CALLS order
+        called = {c for module in modules.values() for c in module.plan.calls}
+        roots = [name for name in modules if name not in called]
+        order = []
+        seen = set()
+        for root in roots + list(modules):
+            stack = [root]
+            while stack:
+                name = stack.pop()
+                if name in seen or name not in modules:
+                    continue
+                seen.add(name)
+                order.append(name)
+                stack.extend(reversed(modules[name].plan.calls))
+        return order
+
+    def resolve(self, patterns=None):
+        #Columns matching "Module.Var" names or glob patterns, in plan order
+        if patterns is None:
+            return self.columns
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        selected = set()
+        for pattern in patterns:
+            matches = fnmatch.filter(self.columns, pattern)
+            if not matches:
+                raise KeyError(f"No numeric variable matches {pattern}")
+            selected.update(matches)
+        return [name for name in self.columns if name in selected]
+
+    def carry(self, previous):
+        #Takes the values of every "Module.Var" previous also has, so a module loaded during a run
+        #does not put the integrated states back to their initial values. Plans of another ensemble
+        #size are left alone
+        if previous.values.shape[1:] != self.values.shape[1:]:
+            return
+        pairs = [(slot, self.index[name]) for name, slot in previous.index.items() if name in self.index]
+        if pairs:
+            old, new = np.array(pairs, dtype=int).T
+            self.values[new] = previous.values[old]
+
+    def reset(self):
+        #Back to the compiled values, dropping every user set value
+        self.restore(self.initial, ())
+
+    def restore(self, values, pinned):
+        #Puts back values and pinned slots of a snapshot taken from an identical plan
+        self._synced = {}
+        self.values[...] = values
+        self.pinned = set(pinned)
+        self.active = [op for op in self.ops if op[0] not in self.pinned] if self.pinned else self.ops
+        self.dirty = set(range(len(self.ops)))
+        self.moved = False
+
+    def fork(self):
+        #Plan for a forked client: ops and indexes are shared, values and pinned slots copied
+        other = copy.copy(self)
+        other.values = self.values.copy()
+        other.pinned = set(self.pinned)
+        other.dirty = set(self.dirty)
+        other.loops = [copy.copy(loop) for loop in self.loops]
+        other._loopAt = {i: loop for loop in other.loops for i in range(loop.start, loop.stop)}
+        other._synced = dict(self._synced)
+        other.profiler = None
+        return other
+
+    def cone(self, slots):
+        #Positions of the ops downstream of the slots, in evaluation order
+        key = tuple(int(s) for s in slots)
+        if key not in self._cones:
+            seen = set()
+            stack = [i for s in key for i in self._readers.get(s, ())]
+            while stack:
+                i = stack.pop()
+                if i not in seen:
+                    seen.add(i)
+                    stack.extend(self._readers.get(self.ops[i][0], ()))
+            self._cones[key] = sorted(seen)
+        return self._cones[key]
+
+    def set(self, slot, value):
+        if slot in self.targets and slot not in self.pinned:
+            # User set values replace the computed ones, also one equal to the current value
+            self.pinned.add(slot)
+            self.active = [op for op in self.ops if op[0] not in self.pinned]
+        if self.reactive and np.array_equal(self.values[slot], value):
+            # Nothing downstream changes
+            return
+        self.dirty.update(self.cone((slot,)))
+        self.values[slot] = value
+
+    def get(self, name):
+        #Current value of a numeric "Module.Var", None if the plan does not compute it
+        slot = self.index.get(name)
+        if slot is None or slot not in self._numeric:
+            return None
+        return self.read(slot)
+
+    def read(self, slot):
+        #Current value of a slot, first evaluating what a set or the integrator left stale
+        if self.moved:
+            self.dirty.update(self.stateCone)
+            self.moved = False
+        if self.dirty:
+            self._evaluate(sorted(self.dirty))
+            self.dirty = set()
+        return self.values[slot]
+
+    def owner(self, slot):
+        #(module name, variable) of a slot
+        if self._owners is None:
+            self._owners = [tuple(name.split('.', 1)) for name in self.names]
+        return self._owners[slot]
+
+    def setRates(self, steps, mode='hold'):
+        #steps: module -> n, its ops are evaluated on every n-th step of a run only, others every step.
+        #Between updates its values hold, or with mode='linear' are extrapolated from the last two.
+        #Ops in algebraic loops always run every step, and so do those computing the DFQ
+        #derivatives from the states, which are integrated every step. See client.setRates
+        if mode not in ('hold', 'linear'):
+            raise ValueError(f"Unknown rate mode: {mode}, expected 'hold' or 'linear'")
+        period = [1] * len(self.ops)
+        if steps:
+            integrated = self._integrated()
+            for i, (target, fn, args) in enumerate(self.ops):
+                if i not in self._loopAt and i not in integrated:
+                    period[i] = max(1, int(steps.get(self.owner(target)[0], 1)))
+        self.periods = sorted(set(period) - {1})
+        self._period = period
+        self._slow = {n: np.array([op[0] for op, p in zip(self.ops, period) if p == n], dtype=int)
+                      for n in self.periods}
+        self._due = {} #Periods due -> positions to evaluate
+        self._synced = {} #Period -> (clock, values, slope) of the last update, for mode='linear'
+        self.rateMode = mode
+
+    def _integrated(self):
+        # Positions of the ops on a path from the states to their derivatives. Held, the
+        # states would be integrated with the derivatives of states long gone
+        at = {op[0]: i for i, op in enumerate(self.ops)}
+        feeds = set()
+        stack = [at[slot] for slot in self.derivs if slot in at]
+        while stack:
+            i = stack.pop()
+            if i not in feeds:
+                feeds.add(i)
+                stack.extend(at[arg] for arg in self.ops[i][2] if arg in at)
+        return feeds.intersection(self.stateCone)
+
+    def _scheduled(self):
+        # Positions due at this clock. Slow targets that are not due are extrapolated first
+        clock = self.clock
+        due = tuple(n for n in self.periods if clock % n == 0)
+        positions = self._due.get(due)
+        if positions is None:
+            positions = self._due[due] = [i for i, n in enumerate(self._period) if n == 1 or n in due]
+        if self.rateMode == 'linear':
+            for n, (synced, base, slope) in self._synced.items():
+                if n not in due:
+                    targets = self._slow[n]
+                    values = base + slope * (clock - synced)
+                    if self.pinned:
+                        free = [j for j, target in enumerate(targets) if target not in self.pinned]
+                        targets, values = targets[free], values[free]
+                    self.values[targets] = values
+        return positions, due
+
+    def _synchronize(self, due):
+        # Values and slope of the groups just updated, for mode='linear'
+        for n in due:
+            values = self.values[self._slow[n]].copy()
+            last = self._synced.get(n)
+            if last is None:
+                self._synced[n] = (self.clock, values, np.zeros_like(values))
+            elif last[0] == self.clock:
+                # Evaluated again within the same step (rk4, rk45, implicit)
+                self._synced[n] = (self.clock, values, last[2])
+            else:
+                self._synced[n] = (self.clock, values, (values - last[1]) / (self.clock - last[0]))
+
+    def step(self):
+        if self.profiler is not None:
+            return self._profiledStep()
+        self.moved = False
+        if not self.reactive:
+            # Evaluates everything due, what a set left stale included
+            if self.dirty:
+                self.dirty = set()
+            if self.periods and self.clock is not None:
+                positions, due = self._scheduled()
+                self._evaluate(positions)
+                if self.rateMode == 'linear':
+                    self._synchronize(due)
+                return
+            if self.loops:
+                self._evaluate(range(len(self.ops)))
+                return
+            v = self.values
+            for target, fn, args in self.active:
+                v[target] = fn(*[v[a] for a in args])
+            return
+        # Only ops downstream of a changed input or of the integrated states
+        if self.dirty:
+            self.dirty.update(self.stateCone)
+            self._evaluate(sorted(self.dirty))
+            self.dirty = set()
+        elif self.stateCone:
+            self._evaluate(self.stateCone)
+
+    def _evaluate(self, positions):
+        v = self.values
+        ops = self.ops
+        pinned = self.pinned
+        if self.loops:
+            # A loop is solved once, at the first of its positions
+            loopAt = self._loopAt
+            solved = None
+            for i in positions:
+                loop = loopAt.get(i)
+                if loop is not None:
+                    if loop is not solved:
+                        loop.solve(v, ops, pinned)
+                        solved = loop
+                    continue
+                target, fn, args = ops[i]
+                if target not in pinned:
+                    v[target] = fn(*[v[a] for a in args])
+            return
+        for i in positions:
+            target, fn, args = ops[i]
+            if target not in pinned:
+                v[target] = fn(*[v[a] for a in args])
+
+    def _profiledStep(self):
+        # Same as step, timing every op as (module, variable, kind)
+        if self._frames is None:
+            self._frames = [tuple(self.names[target].split('.', 1)) + (getattr(fn, 'kind', type(fn).__name__),)
+                            for target, fn, args in self.ops]
+        due = None
+        self.moved = False
+        if not self.reactive:
+            if self.dirty:
+                self.dirty = set()
+            if self.periods and self.clock is not None:
+                positions, due = self._scheduled()
+            else:
+                positions = range(len(self.ops))
+        elif self.dirty:
+            positions = sorted(self.dirty.union(self.stateCone))
+            self.dirty = set()
+        else:
+            positions = self.stateCone
+        v = self.values
+        ops = self.ops
+        pinned = self.pinned
+        record = self.profiler.record
+        solved = None
+        for i in positions:
+            loop = self._loopAt.get(i)
+            if loop is not None:
+                # Timed as a whole under its first member, kind 'loop'
+                if loop is not solved:
+                    start = perf_counter()
+                    loop.solve(v, ops, pinned)
+                    record(self._frames[loop.start][:2] + ('loop',), perf_counter() - start)
+                    solved = loop
+                continue
+            target, fn, args = ops[i]
+            if target not in pinned:
+                start = perf_counter()
+                v[target] = fn(*[v[a] for a in args])
+                record(self._frames[i], perf_counter() - start)
+        if due is not None and self.rateMode == 'linear':
+            self._synchronize(due)
+
+    def setReactive(self, enabled):
+        self.reactive = enabled
+        self.dirty = set(range(len(self.ops)))
@@ -0,0 +1,102 @@
+from collections import defaultdict
+from time import perf_counter
+
+
+# Opt in timings for a client, see HumModClient.profile. Time is kept per call
+# stack, e.g. ('step', 'evaluate', 'AorticValve-Stenosis', 'Effect', 'curve'),
+# as self time, so module, variable and kind totals are sums over stacks.
+
+class Profiler:
+    def __init__(self):
+        self.selfTime = defaultdict(float) #stack -> seconds spent in the frame itself
+        self.calls = defaultdict(int) #stack -> times the frame was entered
+        self.steps = [] #Wall time of every simulated step
+        self._stack = [] #Open frames: [name, start, time spent in children]
+        self._prefix = ()
+
+    def push(self, name):
+        self._stack.append([name, perf_counter(), 0.0])
+        self._prefix += (name,)
+
+    def pop(self):
+        name, start, children = self._stack.pop()
+        elapsed = perf_counter() - start
+        self.selfTime[self._prefix] += elapsed - children
+        self.calls[self._prefix] += 1
+        self._prefix = self._prefix[:-1]
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        return elapsed
+
+    def unwind(self):
+        #Closes frames left open by an interrupted run
+        while self._stack:
+            self.pop()
+
+    def record(self, frames, elapsed):
+        #A finished leaf call below the open frames
+        key = self._prefix + frames
+        self.selfTime[key] += elapsed
+        self.calls[key] += 1
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def summary(self, by='module'):
+        #Rows of (name, calls, cumulative seconds, self seconds), slowest first.
+        #by: 'module', 'variable' or 'kind' of function for the evaluated values, calcs and loads,
+        #or 'frame' for every frame name (step, apply, evaluate, integrate, load, calc, compile, ...)
+        rows = {}
+        for key, seconds in self.selfTime.items():
+            for name, own in self._names(key, by):
+                row = rows.setdefault(name, [0, 0.0, 0.0])
+                row[1] += seconds
+                if own:
+                    row[0] += self.calls[key]
+                    row[2] += seconds
+        return sorted(((name, *row) for name, row in rows.items()), key=lambda r: -r[2])
+
+    def _names(self, key, by):
+        if by == 'frame':
+            return [(name, name == key[-1]) for name in dict.fromkeys(key)]
+        # The innermost of these frames owns the time. Below 'evaluate' and 'integrate' leaves are
+        # (module, variable, kind), below 'calc' (module, variable) with 'calls' for a block's
+        # CALLS, below 'load' (module,). 'compile' has none, its kind is compile
+        for i in range(len(key) - 1, -1, -1):
+            frame = key[i]
+            tail = key[i + 1:]
+            if frame == 'compile':
+                return [('compile', True)] if by == 'kind' else []
+            if frame == 'calc' and len(tail) > 1:
+                if by == 'module':
+                    return [(tail[0], True)]
+                if by == 'variable':
+                    return [(f"{tail[0]}.{tail[1]}", True)]
+                return [(tail[2] if len(tail) > 2 else 'calc', True)]
+            if frame in ('evaluate', 'integrate', 'load') and tail:
+                if frame == 'load':
+                    return {'module': [(tail[0], True)], 'kind': [('load', True)]}.get(by, [])
+                if by == 'module':
+                    return [(tail[0], True)]
+                if by == 'variable':
+                    return [(f"{tail[0]}.{tail[1]}", True)]
+                return [(tail[2], True)]
+        return []
+
+    def table(self, by='module', limit=20):
+        #Summary as printable text
+        lines = [f"{by:<48} {'calls':>10} {'cumulative s':>14} {'self s':>10}"]
+        for name, calls, cumulative, own in self.summary(by)[:limit]:
+            lines.append(f"{name:<48} {calls:>10} {cumulative:>14.6f} {own:>10.6f}")
+        if self.steps:
+            total = sum(self.steps)
+            lines.append(f"{len(self.steps)} steps, {total:.6f} s, {total / len(self.steps) * 1e6:.1f} us per step")
+        return "\n".join(lines)
+
+    def folded(self):
+        #Collapsed stacks with self time in microseconds, for flamegraph.pl or speedscope
+        return "\n".join(f"{';'.join(key)} {int(round(seconds * 1e6))}"
+                         for key, seconds in sorted(self.selfTime.items()) if seconds > 0)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            f.write(self.folded() + "\n")
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+# Process wide cache of loaded structures, shared by every client and thread.
+# Entries are immutable, so handing the same one to many clients is safe.
+# The least recently used entries are dropped past `capacity`; clients that
+# already hold one keep it alive.
+
+class Registry:
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.loads = 0 #Structures actually loaded, the rest were cache hits
+        self._entries = OrderedDict() #key -> structure, oldest use first
+        self._loading = {} #key -> Future of a load in progress in some thread
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        #Cached entry for key, or load(key). Concurrent callers of a key that is
+        #being loaded wait for that load instead of starting their own.
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            pending = self._loading.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._loading[key] = Future()
+        if not owner:
+            return pending.result()
+        try:
+            value = load(key)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            pending.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self.loads += 1
+            self._entries[key] = value
+            self._evict()
+        pending.set_result(value)
+        return value
+
+    def _evict(self):
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def resize(self, capacity):
+        with self._lock:
+            self.capacity = capacity
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+registry = Registry()
@@ -0,0 +1,124 @@
+from collections import namedtuple
+
+import numpy as np
+
+
+# Simulation output: one preallocated float64 array, steps x variables
+# (members x steps x variables for ensembles), and one shared column index.
+# The array is column major so every variable's time series is contiguous.
+
+#One step as yielded by client.run, values is a row (members x row for ensembles)
+Sample = namedtuple('Sample', ['step', 'time', 'columns', 'values'])
+
+
+class Recorder:
+    #Decimates the recorded rows: every stride-th step, or one min/max/mean per stride steps
+    REDUCERS = ('mean', 'min', 'max')
+
+    def __init__(self, stride=1, reduce=None):
+        if stride < 1:
+            raise ValueError("stride must be at least 1")
+        if reduce is not None and reduce not in self.REDUCERS:
+            raise ValueError(f"Unknown reducer: {reduce}, expected one of {self.REDUCERS}")
+        self.stride = stride
+        self.reduce = reduce
+        self.count = 0
+
+    def add(self, step, values, rows):
+        #Returns (first step, row) when a row is due, else None. Rows are only copied when needed
+        if self.reduce is None:
+            return (step, values[rows]) if step % self.stride == 0 else None
+        row = values[rows]
+        if self.count == 0:
+            self.first = step
+            self.acc = row
+        elif self.reduce == 'mean':
+            self.acc += row
+        elif self.reduce == 'min':
+            np.minimum(self.acc, row, out=self.acc)
+        else:
+            np.maximum(self.acc, row, out=self.acc)
+        self.count += 1
+        return self.flush() if self.count == self.stride else None
+
+    def flush(self):
+        #Row of a partially filled window, if any
+        if not self.count:
+            return None
+        row = self.acc / self.count if self.reduce == 'mean' else self.acc
+        self.count = 0
+        return self.first, row
+
+
+class Results:
+    def __init__(self, columns, data, dt=1.0, t0=0.0):
+        self.columns = list(columns)
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.data = data
+        self.dt = dt #Time between rows
+        self.t0 = t0 #Time of the first row
+
+    @classmethod
+    def allocate(cls, columns, nsteps, dt=1.0, members=None):
+        shape = (nsteps, len(columns)) if not members else (members, nsteps, len(columns))
+        return cls(columns, np.empty(shape, order='F'), dt)
+
+    @property
+    def members(self):
+        return self.data.shape[0] if self.data.ndim == 3 else None
+
+    @property
+    def time(self):
+        return self.t0 + np.arange(len(self)) * self.dt
+
+    def __len__(self):
+        return self.data.shape[-2]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, key):
+        #results["Module.Var"] is a view of that column, results[a:b] a view of those steps
+        if isinstance(key, slice):
+            start, _, stride = key.indices(len(self))
+            return Results(self.columns, self.data[..., key, :], self.dt * stride, self.t0 + start * self.dt)
+        return self.data[..., self.index[key]]
+
+    def between(self, t0, t1):
+        #Steps with t0 <= time < t1
+        first = int(np.ceil((t0 - self.t0) / self.dt - 1e-9))
+        last = int(np.ceil((t1 - self.t0) / self.dt - 1e-9))
+        return self[max(first, 0):max(last, 0)]
+
+    def select(self, names):
+        #New Results with only the given columns, in the given order
+        rows = [self.index[name] for name in names]
+        return Results(names, self.data[..., rows], self.dt, self.t0)
+
+    def member(self, i):
+        #Single run view of ensemble member i
+        return Results(self.columns, self.data[i], self.dt, self.t0)
+
+    def rows(self):
+        #Yields each step as a {"Module.Var": value} dict
+        if self.data.ndim != 2:
+            raise ValueError("Select an ensemble member before iterating rows")
+        for row in self.data:
+            yield dict(zip(self.columns, row.tolist()))
+
+    def to_pandas(self):
+        import pandas as pd
+        if self.data.ndim != 2:
+            raise ValueError("Select an ensemble member before exporting")
+        return pd.DataFrame(self.data, index=pd.Index(self.time, name='time'), columns=self.columns, copy=False)
+
+    def to_arrow(self):
+        import pyarrow as pa
+        if self.data.ndim != 2:
+            raise ValueError("Select an ensemble member before exporting")
+        arrays = [pa.array(self.time)] + [pa.array(self.data[:, i]) for i in range(len(self.columns))]
+        return pa.Table.from_arrays(arrays, names=['time'] + self.columns)
+
+    def __repr__(self):
+        shape = 'x'.join(str(n) for n in self.data.shape)
+        return f"Results({shape}, columns={len(self.columns)})"
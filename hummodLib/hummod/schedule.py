@@ -0,0 +1,187 @@
+import json
+from bisect import bisect_right
+
+import numpy as np
+
+
+# Interventions over time, instead of an apply callback:
+#
+#   schedule = Schedule().ramp("TricuspidValve-Regurgitation.Area", 0, 9, 0.0, 9.0)
+#   client.simulate(duration=10, schedule=schedule)
+#
+# Times are in simulation minutes. Steps, ramps and profiles set a variable like
+# Module.set; for a variable with several of them the latest start wins. Before
+# its first start a variable is left alone, after a ramp or profile ends its last
+# value holds. Infusions add rate * timestep to the variable every step they run.
+# Values may be arrays of one value per ensemble member.
+#
+# A schedule is plain data, it pickles for worker processes and saves as JSON.
+# Runs compile it once against the plan, so every step is slot writes only. The
+# writes go through client.write, so scheduled values are set values like those
+# of Module.set: getVar reports them and they survive a recompile of the plan.
+
+
+def _value(value):
+    return np.asarray(value, dtype=float) if np.ndim(value) else float(value)
+
+
+def _cut(value, start, stop):
+    return np.asarray(value)[start:stop] if np.ndim(value) else value
+
+
+def _plain(value):
+    return value.tolist() if isinstance(value, np.ndarray) else value
+
+
+class Schedule:
+    KINDS = ('step', 'ramp', 'profile', 'infusion')
+
+    def __init__(self, events=()):
+        self.events = [] #(kind, "Module.Var", fields), in the order they were added
+        for kind, name, fields in events:
+            self._add(kind, name, **fields)
+
+    def _add(self, kind, name, **fields):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown schedule event {kind}, expected one of {self.KINDS}")
+        self.events.append((kind, name, fields))
+        return self
+
+    def step(self, name, time, value):
+        #Sets name to value from time on
+        return self._add('step', name, time=time, value=value)
+
+    def ramp(self, name, start, stop, begin, end):
+        #Linear from begin at start to end at stop
+        if stop <= start:
+            raise ValueError("A ramp needs stop > start")
+        return self._add('ramp', name, start=start, stop=stop, begin=begin, end=end)
+
+    def profile(self, name, times, values):
+        #Piecewise linear through (time, value) points
+        if len(times) != len(values) or not len(times):
+            raise ValueError("A profile needs as many values as times, at least one")
+        if any(b <= a for a, b in zip(times, times[1:])):
+            raise ValueError("Profile times must increase")
+        return self._add('profile', name, times=list(times), values=list(values))
+
+    def infusion(self, name, start, stop, rate):
+        #Adds rate per minute to name from start until stop
+        return self._add('infusion', name, start=start, stop=stop, rate=rate)
+
+    def names(self):
+        return list(dict.fromkeys(name for _, name, _ in self.events))
+
+    def _check(self, members):
+        # Values given per member need one value for each member
+        for kind, name, fields in self.events:
+            for key, value in fields.items():
+                for v in (value if key == 'values' else [] if key == 'times' else [value]):
+                    if np.ndim(v) and len(v) != (members or 0):
+                        raise ValueError(f"{kind} of {name} has {len(v)} values per member, "
+                                         f"the run has {members or 'no'} members")
+
+    def members(self, start, stop, runs):
+        #Schedule for members start:stop of an ensemble of runs, as a sweep chunk simulates
+        #them. Values given per member are cut to those members
+        self._check(runs)
+        return Schedule((kind, name, {key: value if key == 'times'
+                                      else [_cut(v, start, stop) for v in value] if key == 'values'
+                                      else _cut(value, start, stop) for key, value in fields.items()})
+                        for kind, name, fields in self.events)
+
+    def to_dict(self):
+        return {'events': [{'kind': kind, 'name': name,
+                            **{k: [_plain(v) for v in value] if isinstance(value, list) else _plain(value)
+                               for k, value in fields.items()}}
+                           for kind, name, fields in self.events]}
+
+    @classmethod
+    def from_dict(cls, data):
+        schedule = cls()
+        for event in data['events']:
+            fields = {k: v for k, v in event.items() if k not in ('kind', 'name')}
+            schedule._add(event['kind'], event['name'], **fields)
+        return schedule
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def _segments(self):
+        # name -> segments (t0, t1, v0, v1), the value at t is v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+        # clipped to [t0, t1], so a segment holds its end value until the next one starts
+        events = {}
+        for order, (kind, name, fields) in enumerate(self.events):
+            if kind == 'step':
+                value = _value(fields['value'])
+                segments = [(fields['time'], np.inf, value, value)]
+            elif kind == 'ramp':
+                segments = [(fields['start'], fields['stop'], _value(fields['begin']), _value(fields['end']))]
+            elif kind == 'profile':
+                times = fields['times']
+                values = [_value(v) for v in fields['values']]
+                segments = [(times[i], times[i + 1], values[i], values[i + 1]) for i in range(len(times) - 1)]
+                segments.append((times[-1], np.inf, values[-1], values[-1]))
+            else:
+                continue
+            events.setdefault(name, []).append((segments[0][0], order, segments))
+        resolved = {}
+        for name, entries in events.items():
+            entries.sort(key=lambda e: (e[0], e[1]))
+            segments = []
+            for i, (start, _, own) in enumerate(entries):
+                # An event ends where the next one starts
+                end = entries[i + 1][0] if i + 1 < len(entries) else np.inf
+                segments.extend(s for s in own if s[0] < end or s is own[0])
+            resolved[name] = segments
+        return resolved
+
+    def compile(self, client):
+        #Resolved to slots of the client's plan, see CompiledSchedule.apply
+        plan = client.compile()
+        self._check(client.members)
+        for name in self.names():
+            if name not in plan.index:
+                raise KeyError(f"Scheduled variable {name} is not in the plan")
+        sets = [(plan.index[name], segments) for name, segments in self._segments().items()]
+        infusions = [(plan.index[name], fields['start'], fields['stop'], _value(fields['rate']))
+                     for kind, name, fields in self.events if kind == 'infusion']
+        return CompiledSchedule(client, plan, sets, infusions)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __repr__(self):
+        return f"Schedule({len(self.events)} events on {', '.join(self.names())})"
+
+
+class CompiledSchedule:
+    def __init__(self, client, plan, sets, infusions):
+        self.client = client
+        self.plan = plan
+        self.sets = [(slot, [s[0] for s in segments], segments) for slot, segments in sets]
+        self.infusions = infusions
+
+    def apply(self, time, dt):
+        #Writes the scheduled values for time, like Module.set
+        plan = self.plan
+        write = self.client.write
+        for slot, starts, segments in self.sets:
+            i = bisect_right(starts, time) - 1
+            if i < 0:
+                continue
+            t0, t1, v0, v1 = segments[i]
+            if time >= t1 or t1 == np.inf:
+                value = v1
+            else:
+                value = v0 + (v1 - v0) * ((time - t0) / (t1 - t0))
+            write(slot, value)
+        for slot, start, stop, rate in self.infusions:
+            if start <= time < stop:
+                write(slot, plan.values[slot] + rate * dt)
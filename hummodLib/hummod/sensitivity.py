@@ -0,0 +1,144 @@
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+from .results import Results
+from .sweep import _build, sweep
+
+
+# Sensitivity of recorded outputs to parameters. Every perturbed run of a study is
+# one row of a parameter table, and the whole table is simulated at once: as one
+# ensemble in this process, or as a sweep over worker processes with workers > 0.
+# Runs that several estimates need (the baseline of a Jacobian, the points of a
+# Morris trajectory) are simulated once and shared.
+#
+#   J = jacobian(["TricuspidValve-Regurgitation.Area", "TricuspidValve-Stenosis.Area"],
+#                ["TricuspidValve-Regurgitation.Effect"], modules=["HeartValves"])
+#   J.final()       # params x outputs, at the last recorded row
+
+
+class Sensitivity(Results):
+    #Results with one member per parameter: params x rows x columns
+    def __init__(self, params, columns, data, dt=1.0, t0=0.0):
+        super().__init__(columns, data, dt, t0)
+        self.params = list(params)
+        self.param_index = {name: i for i, name in enumerate(self.params)}
+
+    def param(self, name):
+        #Rows x columns of one parameter
+        return Results(self.columns, self.data[self.param_index[name]], self.dt, self.t0)
+
+    def final(self):
+        #Params x columns at the last recorded row
+        return self.data[:, -1, :]
+
+    def ranking(self, column, row=-1):
+        #Parameter names, largest absolute value of column at row first
+        values = np.abs(self.data[:, row, self.index[column]])
+        return [self.params[i] for i in np.argsort(-values, kind='stable')]
+
+    def __repr__(self):
+        return f"Sensitivity({len(self.params)} params x {len(self)} rows x {len(self.columns)} columns)"
+
+
+#Morris screening: mean, mean of the absolute value and spread of the elementary effects
+Morris = namedtuple('Morris', ['mu', 'mu_star', 'sigma'])
+
+
+def _simulate(table, names, outputs, modules, duration, timestep, workers, chunk, bundle, structures, options):
+    # Outputs of every row of table (runs x params), runs x rows x outputs in the order asked for.
+    # The model is pruned to what the outputs need, so they are "Module.Var" names, not patterns
+    outputs = [outputs] if isinstance(outputs, str) else list(outputs)
+    columns, data, dt = _run(table, names, outputs, modules, duration, timestep, workers, chunk, bundle, structures,
+                             options)
+    return outputs, data[..., [columns.index(name) for name in outputs]], dt
+
+
+def _run(table, names, outputs, modules, duration, timestep, workers, chunk, bundle, structures, options):
+    params = {name: table[:, j] for j, name in enumerate(names)}
+    if workers:
+        with tempfile.TemporaryDirectory() as out_dir:
+            results = sweep(params, out_dir, modules, outputs, outputs, duration, timestep, None, workers, chunk,
+                            bundle, structures, **options)
+            return results.columns, np.array(results.data), results.dt
+    config = {'bundle': bundle, 'structures': structures, 'modules': list(modules), 'outputs': outputs,
+              'params': names, 'options': options}
+    client = _build(config)
+    client.setMembers(len(table))
+    for name, values in params.items():
+        module_name, var = name.split('.', 1)
+        client.getModule(module_name).set(var, np.array(values))
+    results = client.simulate(duration, timestep, members=len(table), record=outputs, **options)
+    return results.columns, results.data, results.dt
+
+
+def _nominal(params, modules, bundle, structures):
+    # {"Module.Var": value}, names alone take the model's initial values
+    if isinstance(params, dict):
+        return list(params), np.array([float(params[name]) for name in params])
+    names = list(params)
+    client = _build({'bundle': bundle, 'structures': structures, 'modules': list(modules), 'outputs': None,
+                     'params': names, 'options': {}})
+    return names, np.array([float(client.plan.values[client.plan.index[name]]) for name in names])
+
+
+def jacobian(params, outputs, modules=(), duration=10.0, timestep=1.0, step=1e-4, central=False, workers=0,
+             chunk=256, bundle=None, structures=None, **options):
+    #d output / d param at every recorded row by finite differences, as a Sensitivity.
+    #params is a list of "Module.Var" names perturbed around their initial values, or a
+    #{"Module.Var": value} dict of the point to take it at. Perturbations are step * max(|value|, 1),
+    #one-sided after one shared baseline run, or on both sides with central=True.
+    #options go to client.run (method, stride, schedule, ...).
+    names, x = _nominal(params, modules, bundle, structures)
+    h = step * np.maximum(np.abs(x), 1.0)
+    k = len(names)
+    if central:
+        table = np.concatenate([x + np.diag(h), x - np.diag(h)])
+    else:
+        table = np.concatenate([x[None, :], x + np.diag(h)])
+    columns, data, dt = _simulate(table, names, outputs, modules, duration, timestep, workers, chunk, bundle,
+                                  structures, options)
+    if central:
+        derivative = (data[:k] - data[k:]) / (2 * h[:, None, None])
+    else:
+        derivative = (data[1:] - data[0]) / h[:, None, None]
+    return Sensitivity(names, columns, derivative, dt)
+
+
+def morris(bounds, outputs, modules=(), duration=10.0, timestep=1.0, trajectories=10, levels=4, seed=0, workers=0,
+           chunk=256, bundle=None, structures=None, **options):
+    #Morris elementary effects screening over {"Module.Var": (low, high)}, each parameter scaled to
+    #[0, 1]. Every trajectory moves one parameter at a time by levels / (2 * (levels - 1)), so
+    #trajectories * (params + 1) runs give trajectories effects per parameter. Returns Morris
+    #(mu, mu_star, sigma), each a Sensitivity of params x rows x outputs.
+    names = list(bounds)
+    low = np.array([float(bounds[name][0]) for name in names])
+    high = np.array([float(bounds[name][1]) for name in names])
+    k = len(names)
+    delta = levels / (2 * (levels - 1))
+    rng = np.random.default_rng(seed)
+    points = []
+    moves = []
+    for _ in range(trajectories):
+        u = rng.integers(0, levels, k) / (levels - 1)
+        order = rng.permutation(k)
+        points.append(u.copy())
+        for i in order:
+            move = delta if u[i] + delta <= 1.0 else -delta
+            u[i] += move
+            points.append(u.copy())
+            moves.append((i, move))
+    table = low + np.array(points) * (high - low)
+    columns, data, dt = _simulate(table, names, outputs, modules, duration, timestep, workers, chunk, bundle,
+                                  structures, options)
+    effects = np.empty((trajectories, k) + data.shape[1:])
+    for t in range(trajectories):
+        for j in range(k):
+            run = t * (k + 1) + j
+            i, move = moves[t * k + j]
+            effects[t, i] = (data[run + 1] - data[run]) / move
+    mu = effects.mean(axis=0)
+    mu_star = np.abs(effects).mean(axis=0)
+    sigma = effects.std(axis=0, ddof=1) if trajectories > 1 else np.zeros_like(mu)
+    return Morris(*(Sensitivity(names, columns, a, dt) for a in (mu, mu_star, sigma)))
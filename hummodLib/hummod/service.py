@@ -0,0 +1,245 @@
+import asyncio
+import fnmatch
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import HumModClient
+from .results import Sample
+
+
+# Asyncio front end. Every session runs client.run in a thread of one shared pool,
+# structures come from the process wide registry so sessions share them.
+#
+#   async with SimulationService(modules=["HeartValves"]) as service:
+#       session = service.session(duration=600, record="*.Effect")
+#       stream = session.subscribe(["TricuspidValve-*"])
+#       session.start()
+#       session.set("TricuspidValve-Regurgitation.Area", 4.0)   # applied before the next step
+#       async for sample in stream:
+#           ...
+#       steps = await session
+#
+# A subscriber queue holds at most maxsize samples. When it is full the simulation
+# waits for the subscriber, or with drop=True the oldest sample is discarded instead.
+
+
+class _Stopped(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, session, signals, maxsize, drop):
+        self.session = session
+        self.signals = signals
+        self.drop = drop
+        self.dropped = 0 #Samples discarded because the subscriber fell behind
+        self.closed = False
+        self.rows = None #Positions of the subscribed signals among the session columns
+        self.columns = None
+        self._queue = asyncio.Queue(maxsize)
+
+    def _select(self, columns):
+        if self.signals is None:
+            self.columns = list(columns)
+        else:
+            patterns = [self.signals] if isinstance(self.signals, str) else self.signals
+            selected = {name for pattern in patterns for name in fnmatch.filter(columns, pattern)}
+            self.columns = [name for name in columns if name in selected]
+        position = {name: i for i, name in enumerate(columns)}
+        self.rows = [position[name] for name in self.columns]
+
+    def _put(self, item):
+        #On the event loop
+        if self.closed:
+            return
+        if self.drop and self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(item)
+
+    def close(self):
+        #Unsubscribes, a simulation waiting on this subscriber goes on
+        self.closed = True
+        self.session._unsubscribe(self)
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        item = await self._queue.get()
+        if item is None:
+            self.closed = True
+            raise StopAsyncIteration
+        if isinstance(item, BaseException):
+            self.closed = True
+            raise item
+        return item
+
+
+class Session:
+    def __init__(self, service, client, duration, timestep, apply=None, **options):
+        self.service = service
+        self.client = client
+        self.duration = duration
+        self.timestep = timestep
+        self.options = options #Passed on to client.run
+        self.columns = None
+        self.step = None #Last step published
+        self.task = None
+        self._apply = apply
+        self._commands = queue.SimpleQueue()
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = False
+        self._loop = None
+
+    def subscribe(self, signals=None, maxsize=64, drop=False):
+        #Async iterator of the samples of the signals ("Module.Var" names or patterns, default all recorded)
+        subscription = Subscription(self, signals, maxsize, drop)
+        with self._lock:
+            if self.columns is not None:
+                subscription._select(self.columns)
+            self._subscribers.append(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self.task = asyncio.ensure_future(self._loop.run_in_executor(self.service.executor, self._run))
+        return self
+
+    def set(self, name, value):
+        #Module.set of a "Module.Var", applied before the next step
+        self._commands.put((name, value))
+
+    def stop(self):
+        #Ends the run before the next step
+        self._stop = True
+
+    def __await__(self):
+        #Number of steps the run published
+        return self.task.__await__()
+
+    def _applyCommands(self, client, step):
+        if self._stop:
+            raise _Stopped
+        while True:
+            try:
+                name, value = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            module_name, var = name.split('.', 1)
+            client.getModule(module_name).set(var, value)
+        if self._apply is not None:
+            self._apply(client, step)
+
+    def _run(self):
+        # Worker thread
+        end = None
+        try:
+            for sample in self.client.run(self.duration, self.timestep, apply=self._applyCommands, **self.options):
+                self._publish(sample)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            end = e
+            raise
+        finally:
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscription in subscribers:
+                self._send(subscription, end)
+        return 0 if self.step is None else self.step + 1
+
+    def _publish(self, sample):
+        if self.columns is None:
+            with self._lock:
+                self.columns = sample.columns
+                for subscription in self._subscribers:
+                    subscription._select(self.columns)
+        self.step = sample.step
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            values = sample.values[..., subscription.rows]
+            self._send(subscription, Sample(sample.step, sample.time, subscription.columns, values))
+
+    def _send(self, subscription, item):
+        # Blocks this worker until the subscriber has room, unless it drops or unsubscribes
+        if subscription.drop:
+            self._loop.call_soon_threadsafe(subscription._put, item)
+            return
+        future = asyncio.run_coroutine_threadsafe(self._wait(subscription, item), self._loop)
+        future.result()
+
+    async def _wait(self, subscription, item):
+        while not subscription.closed:
+            try:
+                await asyncio.wait_for(subscription._queue.put(item), 0.1)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+
+class SimulationService:
+    def __init__(self, modules=(), workers=4, executor=None, bundle=None, structures=None):
+        #modules are loaded once up front so every session starts from cached structures
+        self.bundle = bundle
+        self.structures = structures
+        self.modules = list(modules)
+        self._owned = executor is None
+        self.executor = executor or ThreadPoolExecutor(workers, thread_name_prefix='hummod')
+        self.sessions = []
+        warm = self.client()
+        warm.compile()
+
+    def client(self, modules=None):
+        #Fresh client with the service's structures loaded
+        client = HumModClient(self.bundle, self.structures)
+        for name in self.modules if modules is None else modules:
+            client.getModule(name)
+        return client
+
+    def session(self, duration=10.0, timestep=1.0, modules=None, apply=None, **options):
+        #New session, not started yet so subscribers see every sample. options go to
+        #client.run: record, stride, reduce, members, method, rtol, atol, sinks
+        session = Session(self, self.client(modules), duration, timestep, apply, **options)
+        self.sessions.append(session)
+        return session
+
+    def start(self, duration=10.0, timestep=1.0, modules=None, apply=None, **options):
+        return self.session(duration, timestep, modules, apply, **options).start()
+
+    async def close(self):
+        #Stops every session, waits for them and shuts the pool down if the service made it.
+        #Subscriptions are closed, so a subscriber that stopped reading cannot hold a run up.
+        for session in self.sessions:
+            session.stop()
+            with session._lock:
+                subscribers = list(session._subscribers)
+            for subscription in subscribers:
+                subscription.close()
+        for session in self.sessions:
+            if session.task is not None:
+                try:
+                    await session.task
+                except Exception:
+                    pass
+        self.sessions = []
+        if self._owned:
+            self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,147 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from .results import Results
+
+
+# Sinks receive the samples of client.run as they are computed and write them
+# to disk in chunks. The buffer holds at most `chunk` steps, and is also flushed
+# every `interval` seconds when one is given, so memory stays flat on long runs.
+# A run resumed from a checkpoint opens its sinks at the row it goes on from, and
+# they keep what the interrupted run wrote before it.
+
+class Sink:
+    def __init__(self, path, chunk=4096, interval=None):
+        self.path = path
+        self.chunk = chunk
+        self.interval = interval
+        self.buffer = None
+        self.count = 0
+
+    def open(self, columns, dt, members=None, start=0):
+        #start: first row of this run, the rows before it are kept from an interrupted run
+        self.columns = list(columns)
+        self.dt = dt
+        self.members = members
+        self.start = start
+        shape = (self.chunk, len(columns)) if not members else (self.chunk, members, len(columns))
+        self.buffer = np.empty(shape)
+        self.times = np.empty(self.chunk)
+        self.count = 0
+        self._flushed = time.monotonic()
+        self._open()
+
+    def write(self, sample):
+        self.buffer[self.count] = sample.values
+        self.times[self.count] = sample.time
+        self.count += 1
+        if self.count == self.chunk or (
+                self.interval is not None and time.monotonic() - self._flushed >= self.interval):
+            self.flush()
+
+    def flush(self):
+        if self.count:
+            self._write(self.times[:self.count], self.buffer[:self.count])
+            self.count = 0
+        self._flushed = time.monotonic()
+
+    def close(self):
+        if self.buffer is not None:
+            self.flush()
+            self._close()
+            self.buffer = None
+
+    def _open(self):
+        pass
+
+    def _write(self, times, data):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class NpySink(Sink):
+    #Writes a directory of chunk-00000.npy files plus a manifest.json describing them.
+    #The manifest is rewritten after every chunk, so an interrupted run stays readable.
+    def _open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.manifest = {'columns': self.columns, 'dt': self.dt, 'members': self.members,
+                         'chunks': self._resume() if self.start else []}
+        self._save_manifest()
+
+    def _resume(self):
+        # Chunks of the interrupted run up to self.start rows, the one crossing it cut there
+        path = os.path.join(self.path, 'manifest.json')
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            manifest = json.load(f)
+        if (manifest['columns'], manifest['dt'], manifest['members']) != (self.columns, self.dt, self.members):
+            raise ValueError(f"{self.path} holds another run, it cannot be resumed")
+        chunks = []
+        rows = 0
+        for chunk in manifest['chunks']:
+            if rows >= self.start:
+                break
+            if rows + chunk['rows'] > self.start:
+                file = os.path.join(self.path, chunk['file'])
+                np.save(file, np.load(file)[:self.start - rows])
+                chunk = dict(chunk, rows=self.start - rows)
+            chunks.append(chunk)
+            rows += chunk['rows']
+        if rows < self.start:
+            raise ValueError(f"{self.path} ends at row {rows}, the run resumes at row {self.start}")
+        return chunks
+
+    def _write(self, times, data):
+        name = f"chunk-{len(self.manifest['chunks']):05d}.npy"
+        np.save(os.path.join(self.path, name), data)
+        self.manifest['chunks'].append({'file': name, 't0': float(times[0]), 'rows': len(times)})
+        self._save_manifest()
+
+    def _save_manifest(self):
+        tmp = os.path.join(self.path, 'manifest.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, 'manifest.json'))
+
+    @staticmethod
+    def read(path):
+        #Loads a written directory back into Results
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        chunks = [np.load(os.path.join(path, c['file'])) for c in manifest['chunks']]
+        ncols = len(manifest['columns'])
+        shape = (0, ncols) if not manifest['members'] else (0, manifest['members'], ncols)
+        data = np.concatenate(chunks) if chunks else np.empty(shape)
+        if data.ndim == 3:
+            data = data.transpose(1, 0, 2)
+        t0 = manifest['chunks'][0]['t0'] if chunks else 0.0
+        return Results(manifest['columns'], data, manifest['dt'], t0)
+
+
+class ParquetSink(Sink):
+    #Writes one Parquet file with a row group per chunk. Needs pyarrow.
+    def _open(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self.members:
+            raise ValueError("ParquetSink writes single runs, use NpySink for ensembles")
+        if self.start:
+            # The footer is only written on close, the file of a killed run is unreadable
+            raise ValueError("ParquetSink cannot resume an interrupted run, use NpySink with checkpoints")
+        self._pa = pa
+        schema = pa.schema([('time', pa.float64())] + [(name, pa.float64()) for name in self.columns])
+        self.writer = pq.ParquetWriter(self.path, schema)
+
+    def _write(self, times, data):
+        pa = self._pa
+        arrays = [pa.array(times)] + [pa.array(data[:, i]) for i in range(len(self.columns))]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.writer.schema))
+
+    def _close(self):
+        self.writer.close()
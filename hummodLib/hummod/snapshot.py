@@ -0,0 +1,64 @@
+import io
+import json
+import os
+
+import numpy as np
+
+
+# Mutable state of a client at one point of a run. Structures, curves and plans
+# are immutable once loaded and are never copied, the state is the plan's value
+# array (one contiguous float64 block, slots x members for ensembles) plus what
+# was set by hand. Saved as a single .npz file: the array and a JSON header.
+
+class Snapshot:
+    def __init__(self, names, values, pinned, user, modules, dt=1, members=None, required=None, step=0):
+        self.names = list(names) #slot -> "Module.Var", checked against the plan on restore
+        self.values = values
+        self.pinned = sorted(pinned) #Computed slots replaced by set values
+        self.user = user #module -> {var: value} of every Module.set
+        self.modules = list(modules) #Loaded modules, in load order
+        self.dt = dt
+        self.members = members
+        self.required = required
+        self.step = step #Next step of the run the snapshot was taken in
+
+    @classmethod
+    def capture(cls, client):
+        plan = client.compile()
+        user = {name: {var: np.copy(module.values[var]) if isinstance(module.values[var], np.ndarray) else module.values[var]
+                       for var in module.user_set}
+                for name, module in client.modules.items() if module.user_set}
+        return cls(plan.names, np.ascontiguousarray(plan.values).copy(), plan.pinned, user, client.modules,
+                   client.dt, client.members, client.required)
+
+    def save(self, path):
+        #Written to a temporary file and renamed, so a crash never leaves half a checkpoint
+        header = {
+            'names': self.names, 'pinned': [int(slot) for slot in self.pinned], 'modules': self.modules,
+            'dt': self.dt, 'members': self.members, 'step': self.step,
+            'required': sorted(self.required) if self.required is not None else None,
+            # tolist also turns numpy scalars (set from a loop over np.arange, ...) into plain ones
+            'user': {name: {var: np.asarray(value).tolist() for var, value in values.items()}
+                     for name, values in self.user.items()},
+        }
+        buffer = io.BytesIO()
+        np.savez(buffer, values=self.values, header=np.array(json.dumps(header)))
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            values = f['values']
+            header = json.loads(str(f['header']))
+        user = {name: {var: np.array(value) if isinstance(value, list) else value for var, value in entries.items()}
+                for name, entries in header['user'].items()}
+        required = set(header['required']) if header['required'] is not None else None
+        return cls(header['names'], values, header['pinned'], user, header['modules'], header['dt'],
+                   header['members'], required, header['step'])
+
+    def __repr__(self):
+        shape = 'x'.join(str(n) for n in self.values.shape)
+        return f"Snapshot({len(self.modules)} modules, values {shape}, step {self.step})"
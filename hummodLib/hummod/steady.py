@@ -0,0 +1,156 @@
+import numpy as np
+
+from .integrator import ConvergenceError, Integrator
+
+
+# Equilibrium of the DFQ states, dy/dt = f(y) = 0, without simulating up to it.
+# Pseudo-transient continuation: every iteration is a backward Euler step of size
+# tau, (I / tau - J) dy = f(y), with tau grown as the residual shrinks so the
+# iteration turns into Newton near the solution. J is never formed, GMRES only
+# needs J v, one plan evaluation each. If that stalls the state is stepped with
+# backward Euler of doubling size until the derivatives settle, then continued
+# again from there.
+#
+# Small derivatives alone do not make a steady state: a state with a long time
+# constant has them far from its equilibrium. The last update of every state must
+# be within the tolerance as well, near the solution it is the Newton step, an
+# estimate of the remaining error.
+#
+# Ensembles are solved for every member at once, each with its own tau.
+
+
+def _gmres(matvec, b, restart):
+    # Matrix free GMRES of one cycle, b is (n, members) and solved per member
+    n, m = b.shape
+    k = min(restart, n)
+    beta = np.sqrt(np.sum(b * b, axis=0))
+    basis = [b / np.where(beta > 0, beta, 1.0)]
+    h = np.zeros((k + 1, k, m))
+    for j in range(k):
+        w = np.nan_to_num(matvec(basis[j]), nan=0.0, posinf=0.0, neginf=0.0)
+        for i in range(j + 1):
+            h[i, j] = np.sum(w * basis[i], axis=0)
+            w = w - h[i, j] * basis[i]
+        h[j + 1, j] = np.sqrt(np.sum(w * w, axis=0))
+        basis.append(w / np.where(h[j + 1, j] > 1e-300, h[j + 1, j], 1.0))
+        if np.all(h[j + 1, j] <= 1e-12 * np.maximum(beta, 1e-300)):
+            k = j + 1
+            break
+    rhs = np.zeros(k + 1)
+    x = np.empty((n, m))
+    for member in range(m):
+        rhs[0] = beta[member]
+        coef = np.linalg.lstsq(h[:k + 1, :k, member], rhs, rcond=None)[0]
+        x[:, member] = sum(c * v[:, member] for c, v in zip(coef, basis))
+    return x
+
+
+class SteadyState:
+    def __init__(self, plan, rtol=1e-6, atol=1e-9, max_iter=50, krylov=20, tau=1.0, max_steps=200):
+        self.plan = plan
+        self.rtol = rtol
+        self.atol = atol
+        self.max_iter = max_iter
+        self.krylov = krylov
+        self.tau = tau #First pseudo time step, minutes
+        self.max_steps = max_steps
+        self.integrator = Integrator(plan, 'implicit', rtol=rtol, atol=atol)
+        self.iterations = 0 #Continuation iterations and backward Euler steps
+        self.converged = False
+        self.residual = None #Largest |dy/dt| per member at the state it was left at
+        self.method = None #'continuation' or 'stepping', whichever converged
+
+    @property
+    def evaluations(self):
+        return self.integrator.evaluations
+
+    def _residual(self, y):
+        # Shape (n, members), members == 1 for single runs. NaN outside the model's domain
+        return self.integrator.derivatives(y.reshape(self.shape)).reshape(y.shape)
+
+    def _error(self, y, f):
+        #Per member, <= 1 when settled. Also of an update dy in place of f
+        return np.max(np.abs(f) / (self.atol + self.rtol * np.abs(y)), axis=0)
+
+    def solve(self):
+        #Moves plan to the steady state, returns True if it converged
+        plan = self.plan
+        if not len(plan.states):
+            plan.step()
+            self.converged = True
+            return True
+        self.shape = plan.values[plan.states].shape
+        y = plan.values[plan.states].reshape(len(plan.states), -1).copy()
+        f = self._residual(y)
+        self._continuation(y, f, 'continuation') or self._stepping()
+        f = plan.values[plan.derivs].reshape(len(plan.states), -1)
+        residual = np.max(np.abs(f), axis=0)
+        self.residual = residual if plan.values.ndim > 1 else float(residual[0])
+        return self.converged
+
+    def _continuation(self, y, f, method):
+        tau = np.full(y.shape[1], float(self.tau))
+        norm = np.sqrt(np.sum(f * f, axis=0))
+        change = np.full(y.shape, np.inf) #Last accepted update
+        for _ in range(self.max_iter):
+            if np.all(self._error(y, f) <= 1.0) and np.all(self._error(y, change) <= 1.0):
+                self._set(y, method)
+                return True
+            self.iterations += 1
+            eps = np.sqrt(np.finfo(float).eps) * (1.0 + np.sqrt(np.sum(y * y, axis=0)))
+
+            def matvec(v):
+                # (I / tau - J) v, J v by a forward difference along v, a backward one
+                # for members where y + eps v leaves the domain (SQRT of a negative, ...)
+                fp = self._residual(y + eps * v)
+                bad = ~np.all(np.isfinite(fp), axis=0)
+                if np.any(bad):
+                    fp = np.where(bad, 2 * f - self._residual(y - eps * v), fp)
+                return v / tau - (fp - f) / eps
+
+            dy = _gmres(matvec, f, self.krylov)
+            trial = y + dy
+            f_trial = self._residual(trial)
+            norm_trial = np.sqrt(np.sum(f_trial * f_trial, axis=0))
+            accept = np.isfinite(norm_trial) & (norm_trial <= 2.0 * norm)
+            # Grow tau with the residual reduction, at least doubling it, and shrink it
+            # where the step went wrong
+            growth = np.maximum(2.0, norm / np.maximum(norm_trial, 1e-300))
+            tau = np.where(accept, np.minimum(tau * growth, 1e12), tau / 4)
+            y = np.where(accept, trial, y)
+            change = np.where(accept, dy, change)
+            f = np.where(accept, f_trial, f)
+            norm = np.where(accept, norm_trial, norm)
+            if np.all(tau < 1e-8):
+                break
+        # Leave the plan at the last accepted state for stepping
+        self.integrator.derivatives(y.reshape(self.shape))
+        return False
+
+    def _stepping(self):
+        plan = self.plan
+        dt = float(self.tau)
+        for _ in range(self.max_steps):
+            self.iterations += 1
+            y = plan.values[plan.states].reshape(len(plan.states), -1).copy()
+            f = plan.values[plan.derivs].copy()
+            try:
+                self.integrator.advance(dt)
+                y1 = plan.values[plan.states].reshape(y.shape).copy()
+            except ConvergenceError:
+                y1 = np.full(y.shape, np.nan)
+            f1 = self._residual(y1)
+            if not np.all(np.isfinite(f1)):
+                self._residual(y)
+                dt /= 4
+                continue
+            if np.all(self._error(y1, f1) <= 1.0):
+                # Settled, the continuation finds the state from here
+                return self._continuation(y1, f1, 'stepping')
+            dt *= 2.0 if np.max(np.abs(f1)) <= np.max(np.abs(f)) else 0.5
+        return False
+
+    def _set(self, y, method):
+        self.integrator.derivatives(y.reshape(self.shape))
+        self.converged = True
+        self.method = method
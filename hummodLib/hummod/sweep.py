@@ -0,0 +1,131 @@
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .client import HumModClient
+from .results import Results
+
+
+# Parameter sweeps over a process pool. Runs are cut into chunks and each chunk
+# is simulated as one ensemble by a worker that loaded the model once. Workers
+# write straight into a shared on-disk results.npy (runs x rows x columns) and
+# mark finished chunks, so an interrupted sweep resumes where it stopped.
+
+
+def grid(spec):
+    #{"Module.Var": values, ...} -> every combination, as one array per parameter
+    names = list(spec)
+    combos = list(itertools.product(*(np.atleast_1d(spec[name]) for name in names)))
+    return {name: np.array([combo[i] for combo in combos], dtype=float) for i, name in enumerate(names)}
+
+
+def sample(sampler, n, seed=0):
+    #Calls sampler(rng) -> {"Module.Var": value} n times. Run i always gets the same
+    #generator for a given seed, whatever the chunking or worker count
+    draws = [sampler(np.random.default_rng([seed, i])) for i in range(n)]
+    return {name: np.array([draw[name] for draw in draws], dtype=float) for name in draws[0]} if draws else {}
+
+
+def _build(config):
+    client = HumModClient(config['bundle'], config['structures'])
+    scheduled = config['options']['schedule'].names() if config['options'].get('schedule') else []
+    if config['outputs'] is not None:
+        client.prune(config['outputs'], inputs=config['params'] + scheduled)
+    for name in config['modules']:
+        client.getModule(name)
+    for name in config['params'] + scheduled:
+        client.getModule(name.split('.')[0])
+    client.compile()
+    return client
+
+
+_client = None
+
+
+def _init(config):
+    global _client
+    _client = _build(config)
+
+
+def _runChunk(config, out_dir, start, stop):
+    client = _client
+    client.setMembers(stop - start)
+    client.reset()
+    params = np.load(os.path.join(out_dir, 'params.npy'), mmap_mode='r')[start:stop]
+    for j, name in enumerate(config['params']):
+        module_name, var = name.split('.', 1)
+        client.getModule(module_name).set(var, np.array(params[:, j]))
+    options = dict(config['options'])
+    if options.get('schedule') is not None:
+        options['schedule'] = options['schedule'].members(start, stop, config['runs'])
+    out = np.load(os.path.join(out_dir, 'results.npy'), mmap_mode='r+')
+    for row in client.run(config['duration'], config['timestep'], config['apply'], stop - start,
+                            record=config['record'], **options):
+        if row.columns != config['columns']:
+            raise RuntimeError("Worker model does not match the sweep columns")
+        out[start:stop, row.step // config['stride'], :] = row.values
+    out.flush()
+    del out
+    open(os.path.join(out_dir, 'done', f'{start:09d}'), 'w').close()
+    return start
+
+
+def sweep(params, out_dir, modules=(), outputs=None, record=None, duration=10.0, timestep=1.0, apply=None,
+          workers=None, chunk=256, bundle=None, structures=None, **options):
+    #Runs one simulation per row of params ({"Module.Var": array}, see grid and sample) and returns
+    #Results over out_dir/results.npy, runs x rows x columns. outputs prunes the model to what those
+    #"Module.Var" names need. apply must be picklable. options go to client.run (method, stride, schedule, ...).
+    #Re-running with the same arguments skips the chunks that already finished.
+    names = list(params)
+    table = np.column_stack([np.asarray(params[name], dtype=float) for name in names]) if names else np.empty((0, 0))
+    n = len(table)
+    config = {'bundle': bundle, 'structures': structures, 'modules': list(modules), 'outputs': outputs,
+              'params': names, 'duration': duration, 'timestep': timestep, 'apply': apply,
+              'record': record if record is not None else outputs, 'stride': options.get('stride', 1),
+              'runs': n, 'options': options}
+    if options.get('schedule') is not None:
+        # Per member values are checked before any file is written
+        options['schedule']._check(n)
+    client = _build(config)
+    config['columns'] = client.plan.resolve(config['record'])
+    nrows = -(-int(duration / timestep) // config['stride'])
+
+    manifest = {'columns': config['columns'], 'params': names, 'runs': n, 'rows': nrows, 'chunk': chunk,
+                'dt': timestep * config['stride']}
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    os.makedirs(os.path.join(out_dir, 'done'), exist_ok=True)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f) != manifest or not np.array_equal(np.load(os.path.join(out_dir, 'params.npy')), table):
+                raise ValueError(f"{out_dir} holds a different sweep")
+    else:
+        np.save(os.path.join(out_dir, 'params.npy'), table)
+        np.lib.format.open_memmap(os.path.join(out_dir, 'results.npy'), mode='w+',
+                                  shape=(n, nrows, len(config['columns']))).flush()
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+    done = set(os.listdir(os.path.join(out_dir, 'done')))
+    chunks = [(start, min(start + chunk, n)) for start in range(0, n, chunk) if f'{start:09d}' not in done]
+    if chunks and workers == 0:
+        #In this process, handy for debugging
+        global _client
+        _client = client
+        for start, stop in chunks:
+            _runChunk(config, out_dir, start, stop)
+    elif chunks:
+        with ProcessPoolExecutor(workers, initializer=_init, initargs=(config,)) as pool:
+            for future in [pool.submit(_runChunk, config, out_dir, start, stop) for start, stop in chunks]:
+                future.result()
+    return load(out_dir)
+
+
+def load(out_dir):
+    #Results of a finished sweep, memory mapped
+    with open(os.path.join(out_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    data = np.load(os.path.join(out_dir, 'results.npy'), mmap_mode='r')
+    return Results(manifest['columns'], data, manifest['dt'])
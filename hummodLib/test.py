@@ -24,12 +24,12 @@ def increment(client,i):
 results=client.simulate(duration=10, timestep=1.0, apply=increment)
 
 
-for i, step in enumerate(results):
+for i, step in enumerate(results.rows()):
     print(f"Step {i+1}: {step}")
 
 
 import matplotlib.pyplot as plt
-trace = [float(i["TricuspidValve-Regurgitation.Effect"]) for i in results]
+trace = results["TricuspidValve-Regurgitation.Effect"]
 plt.plot(range(len(trace)), trace, marker='o')
 plt.xlabel('Step')
 plt.ylabel('TricuspidValve-Regurgitation.Effect')
@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from hummod.client import HumModClient
+
+
+# Small structures written to a temporary directory, in the packaged JSON format.
+#   Decay      Mass' = -K * Mass, Mass(0) = 10
+#   Valve      Effect = curve of Area, like the TricuspidValve structures
+#   Growth     M' = K - M * M, stiff for large K
+#   Reader     Twice = 2 * Decay.Mass, CALLS Decay
+#   Tank       Level' = Inflow - Level / Tau, a slow state with equilibrium Inflow * Tau
+#   Leak       Mass' = -Loss with Loss = K * Mass, and Half = Mass / 2 that no derivative reads
+
+MODELS = {
+    "Decay": {
+        "variables": {"Mass": {"type": "var", "value": "10"}, "K": {"type": "parm", "value": "0.5"},
+                      "Change": {"type": "var", "value": None}},
+        "functions": {"Mass": "<DFQ(Mass,Change,0.001)>"},
+        "definitions": {"Dervs": {"Change": "-K * Mass"}},
+    },
+    "Valve": {
+        "variables": {"Area": {"type": "parm", "value": "3.0"}, "Effect": {"type": "var", "value": None},
+                      "Flow": {"type": "var", "value": None}},
+        "functions": {"Effect": "<CURVE((0.0,1.0,0.0),(7.4,0.0,0.0))>"},
+        "definitions": {"Parms": {"Effect": "Effect [ Area ]", "Flow": "Effect * 2"}},
+    },
+    "Growth": {
+        "variables": {"M": {"type": "var", "value": "0"}, "K": {"type": "parm", "value": "100"},
+                      "Change": {"type": "var", "value": None}},
+        "functions": {"M": "<DFQ(M,Change,0.001)>"},
+        "definitions": {"Dervs": {"Change": "K - M * M"}},
+    },
+    "Reader": {
+        "variables": {"Twice": {"type": "var", "value": None}},
+        "definitions": {"Parms": {"Twice": "2 * Decay.Mass", "CALLS": ["Decay.Dervs"]}},
+    },
+    "Tank": {
+        "variables": {"Level": {"type": "var", "value": "0"}, "Inflow": {"type": "parm", "value": "0.02"},
+                      "Tau": {"type": "parm", "value": "100"}, "Change": {"type": "var", "value": None}},
+        "functions": {"Level": "<DFQ(Level,Change,0.001)>"},
+        "definitions": {"Dervs": {"Change": "Inflow - Level / Tau"}},
+    },
+    "Leak": {
+        "variables": {"Mass": {"type": "var", "value": "10"}, "K": {"type": "parm", "value": "0.5"},
+                      "Loss": {"type": "var", "value": None}, "Change": {"type": "var", "value": None},
+                      "Half": {"type": "var", "value": None}},
+        "functions": {"Mass": "<DFQ(Mass,Change,0.001)>"},
+        "definitions": {"Dervs": {"Loss": "K * Mass", "Change": "0 - Loss", "Half": "Mass / 2"}},
+    },
+}
+
+
+@pytest.fixture
+def structures(tmp_path):
+    #Directory holding MODELS as structure files
+    directory = tmp_path / "structures"
+    directory.mkdir()
+    for name, structure in MODELS.items():
+        with open(directory / f"{name}.json", "w") as f:
+            json.dump(structure, f)
+    return str(directory)
+
+
+@pytest.fixture
+def client(structures):
+    return HumModClient(structures=structures)
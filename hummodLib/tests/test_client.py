@@ -0,0 +1,64 @@
+import numpy as np
+
+from hummod.client import HumModClient
+
+
+def test_module_loaded_during_a_run_keeps_the_states(client):
+    client.getModule("Decay")
+
+    def load(client, step):
+        if step == 3:
+            client.getModule("Valve")
+
+    results = client.simulate(duration=6, apply=load)
+    assert np.allclose(results["Decay.Mass"], 10 * 0.5 ** np.arange(6))
+    assert "Valve.Area" in client.plan.index
+
+
+def test_module_loaded_through_calls_keeps_the_states(client):
+    client.getModule("Decay")
+
+    def load(client, step):
+        if step == 2:
+            client.getModule("Reader").calc("Parms")
+
+    results = client.simulate(duration=4, apply=load)
+    assert np.allclose(results["Decay.Mass"], [10, 5, 2.5, 1.25])
+
+
+def test_recompile_keeps_set_values(client):
+    client.getModule("Valve").set("Area", 7.4)
+    client.compile()
+    client.getModule("Decay")
+    assert client.compile().values[client.handle("Valve.Area")] == 7.4
+
+
+def test_getVar_serves_the_integrated_state(client):
+    client.getModule("Decay")
+    assert client.getVar("Decay.Mass") == 10
+    client.simulate(duration=3)
+    assert client.getVar("Decay.Mass") == 1.25
+    assert client.getVar("Decay.Change") == -0.625
+    client.getModule("Reader")
+    assert client.getVar("Reader.Twice") == 2.5
+
+
+def test_reactive_and_plain_reads_agree(structures):
+    seen = []
+    for reactive in (False, True):
+        client = HumModClient(structures=structures)
+        client.getModule("Decay")
+        client.setReactive(reactive)
+        client.simulate(duration=2)
+        client.getModule("Decay").set("K", 1.0)
+        seen.append((client.getVar("Decay.Mass"), client.getVar("Decay.Change")))
+    assert seen == [(2.5, -2.5), (2.5, -2.5)]
+
+
+def test_set_value_wins_over_the_plan(client):
+    client.getModule("Valve")
+    client.compile()
+    client.getModule("Valve").set("Effect", 0.25)
+    client.getModule("Valve").set("Area", 7.0)
+    assert client.getVar("Valve.Effect") == 0.25
+    assert client.getVar("Valve.Flow") == 0.5
@@ -0,0 +1,78 @@
+import json
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from hummod.client import HumModClient
+from hummod.curve import Curve
+from hummod.expression import Expression
+
+CURVES = {"Effect": Curve.parse("<CURVE((0.0,1.0,0.0),(2.0,0.5,-0.2),(4.0,0.0,0.0))>")}
+
+
+@pytest.mark.parametrize("text", [
+    "X + Y * 2 - 3 / Y",
+    "-X ^ 2 + Y ^ 0.5",
+    "IF(X > Y, X, Y * 2)",
+    "IF(X GE 1 AND Y LT 2, 1, 0) + IF(NOT X == Y OR X != 0, 2, 3)",
+    "MIN(X, Y, 1.5) + MAX(X, Y, -1) + MAX(X)",
+    "ABS(X - Y) + EXP(X / 4) + LOG(Y) + LN(Y + 1) + LOG10(Y) + SQRT(X + 1)",
+    "Effect [ X ] * Effect [ Y + 1 ]",
+    "X <= Y",
+])
+def test_scalar_and_batched_paths_agree(text):
+    expression = Expression.parse(text, CURVES)
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0.0, 4.0, 50)
+    y = rng.uniform(0.1, 3.0, 50)
+    x[:5] = y[:5]
+    batched = expression.evaluate(*[{"X": x, "Y": y}[name] for name in expression.names])
+    scalar = [expression(*[{"X": a, "Y": b}[name] for name in expression.names]) for a, b in zip(x, y)]
+    assert np.allclose(np.broadcast_to(batched, x.shape), np.asarray(scalar, dtype=float))
+
+
+@pytest.mark.parametrize("text, x, expected", [
+    ("1 / X", 0.0, np.inf),
+    ("0 / X", 0.0, np.nan),
+    ("SQRT(X)", -1.0, np.nan),
+    ("LOG(X)", 0.0, -np.inf),
+    ("EXP(X)", 1000.0, np.inf),
+    ("X ^ 0.5", -4.0, np.nan),
+])
+def test_out_of_domain_values_without_warnings(text, x, expected):
+    expression = Expression.parse(text, {})
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        scalar = expression(x)
+        batched = expression(np.array([x, 4.0]))
+    assert np.array_equal([scalar, batched[0]], [expected, expected], equal_nan=True)
+
+
+def _broken(structures):
+    with open(os.path.join(structures, "Broken.json"), "w") as f:
+        json.dump({"variables": {"Area": {"type": "parm", "value": "2"}, "Good": {"type": "var", "value": None},
+                                 "Empty": {"type": "var", "value": None}, "Unknown": {"type": "var", "value": None}},
+                   "definitions": {"Parms": {"Good": "2 * Area", "Empty": "", "Unknown": "FOO(Area)"}}}, f)
+    client = HumModClient(structures=structures)
+    client.getModule("Broken")
+    return client
+
+
+def test_bad_definitions_fail_when_evaluated(structures):
+    client = _broken(structures)
+    assert client.getModule("Broken").calc("Good") == 4
+    with pytest.raises(ValueError, match="Broken.Empty"):
+        client.getModule("Broken").calc("Empty")
+    with pytest.raises(ValueError, match="Broken.Unknown: Unknown function FOO"):
+        client.getModule("Broken").calc("Unknown")
+    with pytest.raises(ValueError, match="Broken.Empty"):
+        client.simulate(duration=1)
+
+
+def test_bad_definitions_can_be_set(structures):
+    client = _broken(structures)
+    client.getModule("Broken").set("Empty", 1.0)
+    client.getModule("Broken").set("Unknown", 2.0)
+    assert client.simulate(duration=1)["Broken.Good"][0] == 4
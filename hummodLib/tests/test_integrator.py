@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from hummod.integrator import ConvergenceError, Integrator
+
+
+def _mass(client, method, duration=5.0, timestep=1.0, **options):
+    client.getModule("Decay")
+    return client.simulate(duration=duration, timestep=timestep, method=method, **options)["Decay.Mass"]
+
+
+def test_euler_steps(client):
+    assert np.allclose(_mass(client, "euler"), 10 * 0.5 ** np.arange(5))
+
+
+def test_rk4_is_fourth_order(client):
+    # One step of RK4 on y' = -k y multiplies y by the Taylor polynomial of exp(-k h) to 4th order
+    h = 0.5
+    factor = 1 - h + h ** 2 / 2 - h ** 3 / 6 + h ** 4 / 24
+    assert np.allclose(_mass(client, "rk4"), 10 * factor ** np.arange(5))
+
+
+def test_rk45_follows_the_exact_solution(client):
+    # Within the DFQ's errorlim of 0.001, its absolute tolerance
+    mass = _mass(client, "rk45", rtol=1e-8)
+    assert np.allclose(mass, 10 * np.exp(-0.5 * np.arange(5)), rtol=0, atol=1e-3)
+
+
+def test_implicit_is_backward_euler(client):
+    assert np.allclose(_mass(client, "implicit", rtol=1e-10, atol=1e-12), 10 / 1.5 ** np.arange(5))
+
+
+def test_implicit_ensemble(client):
+    client.getModule("Decay")
+    client.setMembers(3)
+    client.getModule("Decay").set("K", np.array([0.5, 1.0, 4.0]))
+    mass = client.simulate(duration=3, members=3, method="implicit", rtol=1e-10, atol=1e-12)["Decay.Mass"]
+    assert np.allclose(mass, 10 / (1 + np.array([[0.5], [1.0], [4.0]])) ** np.arange(3))
+
+
+def test_implicit_solves_a_stiff_nonlinear_state(client):
+    # M' = K - M^2 from 0: the explicit Euler guess of 100 overshoots far past the root sqrt(K)
+    client.getModule("Growth")
+    m = client.simulate(duration=10, timestep=1.0, method="implicit")["Growth.M"]
+    assert np.all(np.isfinite(m))
+    assert np.all(m[1:] > 9) and np.all(m <= 10.01)
+    assert m[-1] == pytest.approx(10, rel=1e-3)
+
+
+def test_implicit_keeps_the_jacobian_between_steps(client):
+    client.getModule("Decay")
+    plan = client.compile()
+    integrator = Integrator(plan, "implicit", rtol=1e-10, atol=1e-12)
+    plan.step()
+    integrator.advance(1.0)
+    jacobian = integrator.jacobian
+    integrator.derivatives(plan.values[plan.states])
+    integrator.advance(1.0)
+    assert integrator.jacobian is jacobian
+    assert jacobian[0, 0, 0] == pytest.approx(-0.5)
+
+
+def test_implicit_raises_when_it_cannot_converge(client):
+    client.getModule("Growth").set("K", np.nan)
+    plan = client.compile()
+    integrator = Integrator(plan, "implicit", hmin=0.01)
+    plan.step()
+    with pytest.raises(ConvergenceError):
+        integrator.advance(1.0)
+
+
+def test_unknown_method(client):
+    client.getModule("Decay")
+    with pytest.raises(ValueError):
+        Integrator(client.compile(), "midpoint")
@@ -0,0 +1,75 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from hummod.client import HumModClient
+from hummod.loops import schedule
+
+
+def _op(target, *args):
+    return (target, None, args)
+
+
+def test_acyclic_ops_are_sorted():
+    ops, loops = schedule([_op(0, 1), _op(1, 2), _op(2)])
+    assert [op[0] for op in ops] == [2, 1, 0]
+    assert loops == []
+
+
+def test_cycle_is_one_loop_with_a_tear():
+    # 0 and 1 read each other, 2 feeds the cycle and 3 reads it
+    ops, loops = schedule([_op(0, 1), _op(1, 0, 2), _op(2), _op(3, 0)])
+    assert [op[0] for op in ops][0] == 2
+    assert [op[0] for op in ops][-1] == 3
+    (start, stop, tears), = loops
+    assert (start, stop) == (1, 3)
+    assert len(tears) == 1 and tears[0] in (0, 1)
+
+
+def test_self_reading_op_is_a_loop():
+    ops, loops = schedule([_op(0, 0)])
+    assert loops == [(0, 1, [0])]
+
+
+def _loop(structures):
+    # X = 1 + Y / 2 and Y = X / 2 solve to X = 4 / 3, Y = 2 / 3. Z = SQRT(Z + 2) is 2
+    with open(os.path.join(structures, "Loop.json"), "w") as f:
+        json.dump({"variables": {"A": {"type": "parm", "value": "1"}, "X": {"type": "var", "value": None},
+                                 "Y": {"type": "var", "value": None}, "Z": {"type": "var", "value": None}},
+                   "definitions": {"Parms": {"X": "A + Y / 2", "Y": "X / 2", "Z": "SQRT(Z + 2)"}}}, f)
+    client = HumModClient(structures=structures)
+    client.getModule("Loop")
+    return client
+
+
+@pytest.mark.parametrize("method", ["newton", "relax"])
+def test_loops_are_solved(structures, method):
+    client = _loop(structures)
+    client.setLoopSolver(method)
+    results = client.simulate(duration=2)
+    assert np.allclose(results["Loop.X"], 4 / 3)
+    assert np.allclose(results["Loop.Y"], 2 / 3)
+    assert np.allclose(results["Loop.Z"], 2)
+    assert len(client.plan.loops) == 2
+    assert not any(loop.failures for loop in client.plan.loops)
+
+
+def test_loops_are_solved_per_member(structures):
+    client = _loop(structures)
+    client.setMembers(3)
+    client.getModule("Loop").set("A", np.array([1.0, 2.0, 3.0]))
+    results = client.simulate(duration=1, members=3)
+    assert np.allclose(results["Loop.X"][:, 0], np.array([1.0, 2.0, 3.0]) * 4 / 3)
+
+
+def test_a_set_tear_breaks_the_loop(structures):
+    client = _loop(structures)
+    client.getModule("Loop").set("Y", 1.0)
+    assert client.simulate(duration=1)["Loop.X"][0] == 1.5
+
+
+def test_loop_read_outside_a_run(structures):
+    client = _loop(structures)
+    assert client.getModule("Loop").calc("X") == pytest.approx(4 / 3)
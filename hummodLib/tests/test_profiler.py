@@ -0,0 +1,23 @@
+def _names(profiler, by):
+    return {row[0] for row in profiler.summary(by)}
+
+
+def test_calc_and_calls_are_timed(client):
+    profiler = client.profile()
+    assert client.getModule("Reader").calc("Parms") == 20
+    assert not profiler._stack
+    assert {"load", "calc", "calls"} <= _names(profiler, "frame")
+    assert {"Reader", "Decay"} <= _names(profiler, "module")
+    assert {"Reader.Parms", "Decay.Dervs", "Decay.Change"} <= _names(profiler, "variable")
+    assert {"calc", "calls", "load"} <= _names(profiler, "kind")
+    assert ("calc", "Reader", "Parms", "calls", "calc", "Decay", "Dervs") in profiler.calls
+
+
+def test_compile_is_timed(client):
+    client.getModule("Valve")
+    profiler = client.profile()
+    client.simulate(duration=2)
+    assert "compile" in _names(profiler, "frame")
+    assert "compile" in _names(profiler, "kind")
+    assert {"Valve.Effect", "Valve.Flow"} <= _names(profiler, "variable")
+
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("mode", ["hold", "linear"])
+def test_slow_module_integrates_its_states_every_step(client, mode):
+    client.getModule("Leak")
+    client.setRates({"Leak": 4}, mode)
+    results = client.simulate(duration=8)
+    assert np.allclose(results["Leak.Mass"], 10 * 0.5 ** np.arange(8))
+    assert np.allclose(results["Leak.Change"], -5 * 0.5 ** np.arange(8))
+
+
+def test_slow_module_holds_what_no_derivative_reads(client):
+    client.getModule("Leak")
+    client.setRates({"Leak": 4})
+    half = client.simulate(duration=8)["Leak.Half"]
+    assert np.allclose(half, np.repeat([5.0, 5 * 0.5 ** 4], 4))
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from hummod.client import HumModClient
+
+
+def _valve(client, reactive):
+    client.getModule("Valve")
+    client.setReactive(reactive)
+    client.compile()
+    return client.getModule("Valve")
+
+
+@pytest.mark.parametrize("reactive", [False, True])
+def test_set_to_the_current_value_pins_it(client, reactive):
+    valve = _valve(client, reactive)
+    effect = float(valve.get("Effect"))
+    valve.set("Effect", effect)
+    valve.set("Area", 7.0)
+    results = client.simulate(duration=2)
+    assert np.allclose(results["Valve.Effect"], effect)
+    assert valve.get("Effect") == effect
+    assert np.allclose(results["Valve.Flow"], 2 * effect)
+
+
+def test_reactive_recomputes_only_the_cone_of_a_set(client):
+    valve = _valve(client, True)
+    plan = client.compile()
+    plan.step()
+    assert not plan.dirty
+    valve.set("Area", 7.4)
+    assert plan.dirty == set(plan.cone((client.handle("Valve.Area"),)))
+    assert abs(valve.get("Flow")) < 1e-12
+    assert not plan.dirty
+
+
+def test_reactive_matches_a_full_evaluation(structures):
+    runs = []
+    for reactive in (False, True):
+        client = HumModClient(structures=structures)
+        client.getModule("Valve")
+        client.getModule("Decay")
+        client.setReactive(reactive)
+
+        def ramp(client, step):
+            client.getModule("Valve").set("Area", step * 0.5)
+
+        runs.append(client.simulate(duration=6, apply=ramp).data)
+    assert np.array_equal(runs[0], runs[1])
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from hummod.schedule import Schedule
+from hummod.sweep import sweep
+
+
+def test_scheduled_values_are_set_values(client):
+    client.getModule("Valve")
+    results = client.simulate(duration=10, schedule=Schedule().ramp("Valve.Area", 0, 9, 0.0, 9.0))
+    assert np.allclose(results["Valve.Area"], np.minimum(np.arange(10), 9))
+    assert client.getVar("Valve.Area") == 9.0
+    assert client.getVar("Valve.Effect") == results["Valve.Effect"][-1]
+
+
+def test_scheduled_values_survive_a_recompile(client):
+    client.getModule("Valve")
+
+    def load(client, step):
+        if step == 4:
+            client.getModule("Decay")
+
+    results = client.simulate(duration=8, apply=load, schedule=Schedule().step("Valve.Area", 2, 7.4))
+    assert np.allclose(results["Valve.Area"], [3, 3, 7.4, 7.4, 7.4, 7.4, 7.4, 7.4])
+    assert np.allclose(results["Valve.Effect"][2:], 0)
+
+
+def test_infusion_adds_rate_per_step(client):
+    client.getModule("Valve")
+    results = client.simulate(duration=5, timestep=0.5, schedule=Schedule().infusion("Valve.Area", 1, 2, 2.0))
+    assert np.allclose(results["Valve.Area"], [3, 3, 4, 5, 5, 5, 5, 5, 5, 5])
+
+
+def test_sweep_cuts_per_member_values_to_its_chunks(structures, tmp_path):
+    area = np.arange(5, dtype=float)
+    schedule = Schedule().step("Valve.Area", 1, area)
+    results = sweep({"Decay.K": np.full(5, 0.5)}, str(tmp_path / "sweep"), modules=["Valve"], duration=3,
+                    workers=0, chunk=2, structures=structures, schedule=schedule)
+    assert np.allclose(results["Valve.Area"][:, 0], 3)
+    assert np.allclose(results["Valve.Area"][:, 1:], area[:, None])
+
+
+def test_per_member_values_must_match_the_members(client, structures, tmp_path):
+    schedule = Schedule().step("Valve.Area", 1, [1.0, 2.0, 3.0])
+    client.getModule("Valve")
+    with pytest.raises(ValueError):
+        client.simulate(duration=2, members=2, schedule=schedule)
+    with pytest.raises(ValueError):
+        sweep({"Decay.K": np.full(5, 0.5)}, str(tmp_path / "sweep"), modules=["Valve"], duration=2,
+              workers=0, structures=structures, schedule=schedule)
+
+
+def test_scheduled_computed_value_stays_pinned_after_the_run(client):
+    client.getModule("Valve")
+    client.simulate(duration=3, schedule=Schedule().step("Valve.Effect", 0, 0.25))
+    client.getModule("Decay")
+    client.simulate(duration=1)
+    assert client.getVar("Valve.Effect") == 0.25
+    assert client.getVar("Valve.Flow") == 0.5
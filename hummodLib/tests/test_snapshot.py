@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from conftest import HERE
+from hummod.client import HumModClient
+from hummod.sinks import NpySink
+
+
+def test_restore_goes_back_to_the_snapshot(client):
+    client.getModule("Decay")
+    snapshot = client.snapshot()
+    client.simulate(duration=3)
+    client.restore(snapshot)
+    results = client.simulate(duration=3)
+    assert np.allclose(results["Decay.Mass"], [10, 5, 2.5])
+
+
+def test_fork_is_independent(client):
+    client.getModule("Valve")
+    client.compile()
+    other = client.fork()
+    other.getModule("Valve").set("Area", 7.4)
+    assert client.simulate(duration=1)["Valve.Effect"][0] > 0.5
+    assert abs(other.simulate(duration=1)["Valve.Effect"][0]) < 1e-12
+
+
+def test_save_and_load_keep_set_values(client, tmp_path):
+    client.getModule("Valve").set("Area", np.int64(2))
+    client.compile()
+    path = str(tmp_path / "state.npz")
+    client.snapshot().save(path)
+    other = HumModClient(structures=client.structures)
+    other.restore(path)
+    assert other.getModule("Valve").values["Area"] == 2
+    assert np.array_equal(other.plan.values, client.plan.values)
+
+
+_KILLED_RUN = """
+import os, sys
+sys.path.insert(0, {root!r})
+from hummod.client import HumModClient
+from hummod.sinks import NpySink
+
+def kill(client, step):
+    if step == 7:
+        os._exit(1)
+
+client = HumModClient(structures={structures!r})
+client.getModule("Decay")
+for _ in client.run(10, 1.0, kill, sinks=[NpySink({sink!r}, chunk=4)], checkpoint={checkpoint!r}, every=5):
+    pass
+"""
+
+
+def test_checkpoint_resume_keeps_sink_rows(structures, tmp_path):
+    sink = str(tmp_path / "out")
+    checkpoint = str(tmp_path / "run.npz")
+    script = _KILLED_RUN.format(root=os.path.join(HERE, ".."), structures=structures, sink=sink,
+                                checkpoint=checkpoint)
+    # A hard kill at step 7, no finally clause runs
+    assert subprocess.run([sys.executable, "-c", script]).returncode == 1
+    assert os.path.exists(checkpoint)
+
+    client = HumModClient(structures=structures)
+    client.getModule("Decay")
+    for _ in client.run(10, 1.0, sinks=[NpySink(sink, chunk=4)], checkpoint=checkpoint, every=5):
+        pass
+    assert not os.path.exists(checkpoint)
+
+    reference = HumModClient(structures=structures)
+    reference.getModule("Decay")
+    expected = reference.simulate(duration=10)
+    written = NpySink.read(sink)
+    assert written.columns == expected.columns
+    assert np.allclose(written.data, expected.data)
+    assert np.allclose(written["Decay.Mass"], 10 * 0.5 ** np.arange(10))
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+
+def test_steady_state_of_a_slow_state(client):
+    # Level' = Inflow - Level / Tau settles at Inflow * Tau = 2, with derivatives
+    # that are small long before it gets there
+    client.getModule("Tank")
+    snapshot = client.steadyState(rtol=1e-3, atol=1e-4)
+    assert snapshot.converged
+    assert snapshot.iterations > 0
+    assert snapshot.residual <= 1e-4
+    assert client.getVar("Tank.Level") == pytest.approx(2.0, rel=1e-3)
+    assert client.steadyState().residual <= 1e-6
+    assert client.getVar("Tank.Level") == pytest.approx(2.0, rel=1e-6)
+
+
+def test_steady_state_of_an_ensemble(client):
+    client.getModule("Tank")
+    client.setMembers(3)
+    client.getModule("Tank").set("Inflow", np.array([0.01, 0.02, 0.04]))
+    snapshot = client.steadyState(members=3)
+    assert snapshot.converged
+    assert snapshot.residual.shape == (3,)
+    assert np.allclose(client.getVar("Tank.Level"), [1.0, 2.0, 4.0])
+
+
+def test_steady_state_warns_when_it_does_not_converge(client):
+    client.getModule("Tank")
+    with pytest.warns(RuntimeWarning):
+        snapshot = client.steadyState(max_iter=1, max_steps=1)
+    assert not snapshot.converged
+    assert snapshot.residual > 1e-6
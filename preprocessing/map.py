@@ -1,11 +1,15 @@
 import json
 import os
 import shutil
+import sys
 from parser import Parser
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hummodLib"))
+from hummod.graph import DependencyIndex
+
 parser = Parser()
 dependencyMap = {}
-missing_files = [] 
+missing_files = []
 
 
 
@@ -13,35 +17,33 @@ def addDependencies(file):
     dependencies = parser.getDependencies(file)
     dependencyMap[file] = {"dependencies":list(dependencies), "count":0}
 
-for file in os.listdir("structs"):
-    addDependencies(file)
-
-
-
-
-visited = set()
 
-def countDeps(file):
-    if file in visited:
-        return 0
-    visited.add(file)
-    deps = dependencyMap[file]['dependencies']
-    count = len(deps)
-    for dep in deps:
-        dep_file = dep + ".DES"
-        if dep_file in dependencyMap:
-            count += countDeps(dep_file)
-        else:
-            missing_files.append(dep_file)
-    return count
 
-for i in dependencyMap:
-    visited.clear()
-    dependencyMap[i]['count'] = countDeps(i)
 
+def countAll():
+    # Count is the number of dependency entries over everything a file transitively
+    # depends on, itself included. One pass over the SCC condensation instead of a DFS per file.
+    edges = {}
+    for file, data in dependencyMap.items():
+        edges[file] = []
+        for dep in data['dependencies']:
+            dep_file = dep + ".DES"
+            if dep_file in dependencyMap:
+                edges[file].append(dep_file)
+            else:
+                missing_files.append(dep_file)
+    index = DependencyIndex(edges)
+    counts = index.closureSums([len(dependencyMap[f]['dependencies']) for f in index.names], includeSelf=True)
+    for file, count in zip(index.names, counts):
+        dependencyMap[file]['count'] = int(count)
+    return index
 
 
+if __name__ == "__main__":
+    for file in os.listdir("structs"):
+        addDependencies(file)
 
+    countAll()
 
-with open("map.json", "w") as f:
-    json.dump(dependencyMap, f, indent=4)    
+    with open("map.json", "w") as f:
+        json.dump(dependencyMap, f, indent=4)
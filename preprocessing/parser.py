@@ -16,14 +16,21 @@ class Parser():
         with open(jsonFile, 'w') as f:
             json.dump(variables, f, indent=1)
     
-    def getDependencies(self, filename):
+    def read(self, filename):
         filepath = os.path.join(self.sourceDir, filename)
         try:
             with open(filepath, 'r') as f:
-                content = f.read()
+                return f.read()
         except FileNotFoundError:
             print(f"File not found: {filepath}")
-            return set()
+            return None
+
+    def getDependencies(self, filename, content=None):
+        # content can be passed in when the file was already read
+        if content is None:
+            content = self.read(filename)
+            if content is None:
+                return set()
 
         # Extract content between <structure> tags
         start = content.find("<structure>")
@@ -81,14 +88,12 @@ class Parser():
                     
         return out
 
-    def parse(self, filename):
+    def parse(self, filename, content=None):
         filepath = os.path.join(self.sourceDir, filename)
-        try:
-            with open(filepath, 'r') as f:
-                content = f.read()
-        except FileNotFoundError:
-            print(f"File not found: {filepath}")
-            return {}
+        if content is None:
+            content = self.read(filename)
+            if content is None:
+                return {}
 
         # Extract content between <structure> tags
         start = content.find("<structure>")
@@ -149,6 +154,15 @@ class Parser():
                                 slope = slope_elem.text.strip() if slope_elem.text else ""
                                 points.append(f"({x},{y},{slope})")
                         functions[name] = f"<CURVE({','.join(points)})>"
+                elif func.tag == "dfq":
+                    name_elem = func.find("name")
+                    if name_elem is not None:
+                        name = name_elem.text.strip() if name_elem.text else ""
+                        fields = []
+                        for tag in ("integralname", "derivname", "errorlim"):
+                            elem = func.find(tag)
+                            fields.append(elem.text.strip() if elem is not None and elem.text else "")
+                        functions[name] = f"<DFQ({','.join(fields)})>"
 
         # Parse definitions section
         definitions = {}
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import map as depmap
+from parser import Parser
+
+# Reads every .DES once and produces both its JSON structure and its dependencies,
+# across a process pool. A manifest of content hashes in outDir lets later runs
+# skip every file that did not change.
+
+MANIFEST = ".manifest.json"
+
+
+def process(sourceDir, outDir, filename, content):
+    parser = Parser(sourceDir, outDir)
+    structure = parser.parse(filename, content)
+    with open(os.path.join(outDir, filename[:-4] + ".json"), 'w') as f:
+        json.dump(structure, f, indent=1)
+    return filename, sorted(parser.getDependencies(filename, content))
+
+
+def run(sourceDir, outDir, mapFile="map.json", workers=None):
+    if not os.path.exists(outDir):
+        os.makedirs(outDir)
+    manifestPath = os.path.join(outDir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifestPath):
+        with open(manifestPath) as f:
+            manifest = json.load(f)
+
+    files = sorted(f for f in os.listdir(sourceDir) if f.endswith(".DES"))
+    changed = {}
+    hashes = {}
+    for filename in files:
+        with open(os.path.join(sourceDir, filename), 'r') as f:
+            content = f.read()
+        hashes[filename] = hashlib.sha256(content.encode()).hexdigest()
+        entry = manifest.get(filename)
+        if entry is None or entry["hash"] != hashes[filename] or \
+                not os.path.exists(os.path.join(outDir, filename[:-4] + ".json")):
+            changed[filename] = content
+    print(f"{len(changed)} of {len(files)} files changed")
+
+    if changed:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(process, sourceDir, outDir, filename, content)
+                       for filename, content in changed.items()]
+            for future in futures:
+                filename, dependencies = future.result()
+                manifest[filename] = {"hash": hashes[filename], "dependencies": dependencies}
+                print(f"Parsed {filename}")
+
+    # Files that disappeared from the source drop out of the manifest
+    manifest = {filename: manifest[filename] for filename in files}
+    with open(manifestPath + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifestPath + ".tmp", manifestPath)
+
+    depmap.dependencyMap.clear()
+    for filename in files:
+        depmap.dependencyMap[filename] = {"dependencies": manifest[filename]["dependencies"], "count": 0}
+    depmap.countAll()
+    with open(mapFile, "w") as f:
+        json.dump(depmap.dependencyMap, f, indent=4)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python pipeline.py sourceDir outDir [map.json]")
+        sys.exit(1)
+    run(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "map.json")